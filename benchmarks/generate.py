@@ -0,0 +1,334 @@
+"""Reproducible synthetic key and system corpora for the benchmarks.
+
+python -m benchmarks.generate key_file sys_file [conll] [--documents N] [--mentions N] ...
+
+The options are the keys of DEFAULT_CONFIG. The key documents are made of
+random entities, the system documents are the key documents with a share of
+system_error of missing, spurious, split and merged markables and clusters and
+markables with wrong boundaries. The files are written in the UA format, or with conll in the
+CoNLL-2012 format of scorer.py (only the referring identity clusters).
+"""
+import argparse
+import random
+
+DEFAULT_CONFIG = {
+    'documents': 100,
+    'mentions': 100,  # markables per document
+    'cluster_size': 3.0,  # average size of the clusters that are not singletons
+    'singleton_rate': 0.3,  # share of the entities that are singletons
+    'non_referring_rate': 0.2,  # share of the singletons that are non-referring
+    'split_antecedent_rate': 0.05,  # share of the entities with split-antecedents
+    'bridging_rate': 0.1,  # share of the markables that are bridging anaphors
+    'discourse_deixis_rate': 0.05,  # discourse deixis anaphors per markable
+    'sentence_length': 20,
+    'system_error': 0.2,
+    'seed': 0,
+}
+
+UA_COLUMNS = ('# global.columns = ID FORM LEMMA UPOS XPOS FEATS HEAD DEPREL DEPS MISC '
+    'IDENTITY BRIDGING DISCOURSE_DEIXIS')
+
+
+def generate(config=None):
+  """Returns the (key_docs, sys_docs) of the config, see generate_document."""
+  config = dict(DEFAULT_CONFIG, **(config or {}))
+  rng = random.Random(config['seed'])
+  key_docs, sys_docs = [], []
+  for i in range(config['documents']):
+    key_doc = generate_document(rng, 'doc%d' % i, config)
+    key_docs.append(key_doc)
+    sys_docs.append(get_system_document(rng, key_doc, config))
+  return key_docs, sys_docs
+
+
+def generate_document(rng, doc_name, config):
+  """A document is a dict with its name, its number of tokens, its sentence
+  length and:
+    markables: {markable_id: (start, end, entity_id, MIN)}
+    element_of: {markable_id: [entity_id of a plural entity]}
+    bridging: {anaphor markable_id: antecedent markable_id}
+    discourse_deixis: {markable_id: (start, end, entity_id)}
+  where entity_id ends with -Pseudo for non-referring markables."""
+  sentence_length = config['sentence_length']
+  sentences_num = max(1, -(-config['mentions'] * 5 // (2 * sentence_length)))
+  tokens_num = sentences_num * sentence_length
+  spans = get_spans(rng, config['mentions'], tokens_num, sentence_length)
+
+  markables = {}
+  entities = []
+  i = 0
+  while i < len(spans):
+    if rng.random() < config['singleton_rate']:
+      size = 1
+    else:
+      # a long tail of large clusters, as in real documents
+      size = 2 + int(rng.expovariate(1 / max(config['cluster_size'] - 2, 1e-6)))
+    entity_id = str(len(entities) + 1)
+    if size == 1 and rng.random() < config['non_referring_rate']:
+      entity_id += '-Pseudo'
+    entity = []
+    for start, end in spans[i:i + size]:
+      markable_id = 'm%d' % (len(markables) + 1)
+      head = rng.randint(start, end)
+      markables[markable_id] = (start, end, entity_id, (head, head))
+      entity.append(markable_id)
+    entities.append((entity_id, entity))
+    i += size
+
+  element_of = get_element_of(rng, entities, config['split_antecedent_rate'])
+
+  markable_ids = sorted(markables, key=lambda m: markables[m][:2])
+  bridging = {}
+  for i, markable_id in enumerate(markable_ids):
+    if i > 0 and rng.random() < config['bridging_rate']:
+      antecedent = markable_ids[rng.randrange(i)]
+      if markables[antecedent][2] != markables[markable_id][2]:
+        bridging[markable_id] = antecedent
+
+  # the antecedents of discourse deixis are sentences, the anaphors single
+  # tokens of later sentences
+  discourse_deixis = {}
+  anaphors_num = int(config['mentions'] * config['discourse_deixis_rate'])
+  for entity_num, sentence in enumerate(rng.sample(range(sentences_num - 1), min(anaphors_num, sentences_num - 1))):
+    entity_id = 'dd%d' % (entity_num + 1)
+    start = sentence * sentence_length
+    discourse_deixis['d%d' % (len(discourse_deixis) + 1)] = (start, start + sentence_length - 1, entity_id)
+    anaphor = rng.randrange(start + sentence_length, tokens_num)
+    discourse_deixis['d%d' % (len(discourse_deixis) + 1)] = (anaphor, anaphor, entity_id)
+
+  return {'name': doc_name, 'tokens': tokens_num, 'sentence_length': sentence_length,
+      'markables': markables, 'element_of': element_of, 'bridging': bridging,
+      'discourse_deixis': discourse_deixis}
+
+
+def get_spans(rng, spans_num, tokens_num, sentence_length, spans=None):
+  """Adds random spans within sentences to spans ({sentence: set of spans},
+  see add_span) until there are spans_num of them, and returns all the spans
+  in a random order."""
+  spans = spans if spans is not None else {}
+  spans_total = sum(len(sentence_spans) for sentence_spans in spans.values())
+  for _ in range(spans_num * 20):
+    if spans_total >= spans_num:
+      break
+    start = rng.randrange(tokens_num)
+    end = min(start + rng.choice([0, 0, 0, 1, 1, 2, 3, 5]),
+        (start // sentence_length + 1) * sentence_length - 1)
+    if add_span(spans, start, end, sentence_length):
+      spans_total += 1
+  spans = sorted(span for sentence_spans in spans.values() for span in sentence_spans)
+  rng.shuffle(spans)
+  return spans
+
+
+def add_span(spans, start, end, sentence_length):
+  """Adds the span to the spans of its sentence unless it is there already or
+  crosses one of them, as the markables may nest but not cross."""
+  sentence_spans = spans.setdefault(start // sentence_length, set())
+  if (start, end) in sentence_spans or start // sentence_length != end // sentence_length or any(
+      s < start <= e < end or start < s <= end < e for s, e in sentence_spans):
+    return False
+  sentence_spans.add((start, end))
+  return True
+
+
+def get_element_of(rng, entities, split_antecedent_rate):
+  """Makes a share of the referring entities plural, with two or three other
+  referring entities as their split-antecedents. The first markable of each
+  member entity gets the plural entity in its ElementOf."""
+  referring = [(entity_id, entity) for entity_id, entity in entities if not entity_id.endswith('-Pseudo')]
+  plurals = set()
+  members = set()
+  element_of = {}
+  for entity_id, _ in referring:
+    if entity_id in members or rng.random() >= split_antecedent_rate:
+      continue
+    candidates = [(e_id, e) for e_id, e in referring if e_id != entity_id and e_id not in plurals]
+    if len(candidates) < 3:
+      continue
+    plurals.add(entity_id)
+    for member_id, member in rng.sample(candidates, rng.choice([2, 2, 3])):
+      members.add(member_id)
+      element_of.setdefault(member[0], []).append(entity_id)
+  return element_of
+
+
+def get_system_document(rng, key_doc, config):
+  """The key document with errors, see the module docstring."""
+  error = config['system_error']
+  tokens_num, sentence_length = key_doc['tokens'], key_doc['sentence_length']
+  markables = {}
+  spans = {}
+  for markable_id, (start, end, entity_id, _) in sorted(key_doc['markables'].items(),
+      key=lambda m: (m[1][0], -m[1][1])):
+    r = rng.random()
+    if r < error * 0.3:
+      continue
+    # the wrong boundaries of the markables with more than one token still
+    # match in the minimum span setting
+    wrong_end = end - 1 if end > start else end + 1
+    if r < error * 0.5 and add_span(spans, start, wrong_end, sentence_length):
+      markables[markable_id] = [start, wrong_end, entity_id]
+    elif add_span(spans, start, end, sentence_length):
+      markables[markable_id] = [start, end, entity_id]
+
+  # split and merge clusters
+  entity_ids = sorted(set(m[2] for m in markables.values()))
+  for entity_id in entity_ids:
+    if entity_id.endswith('-Pseudo'):
+      continue
+    if rng.random() < error * 0.3:
+      for markable in markables.values():
+        if markable[2] == entity_id and rng.random() < 0.5:
+          markable[2] = entity_id + 'b'
+    elif rng.random() < error * 0.2:
+      other = rng.choice(entity_ids)
+      if not other.endswith('-Pseudo'):
+        for markable in markables.values():
+          if markable[2] == other:
+            markable[2] = entity_id
+
+  # spurious markables, as singletons or in the existing clusters
+  spurious = int(len(key_doc['markables']) * error * 0.2)
+  referring_ids = sorted(set(m[2] for m in markables.values() if not m[2].endswith('-Pseudo')))
+  existing = set((start, end) for start, end, _ in markables.values())
+  for i, (start, end) in enumerate(get_spans(rng, len(existing) + spurious, tokens_num,
+      sentence_length, spans)):
+    if (start, end) in existing:
+      continue
+    if referring_ids and rng.random() < 0.5:
+      entity_id = rng.choice(referring_ids)
+    else:
+      entity_id = 's%d' % i
+    markables['s%d' % i] = [start, end, entity_id]
+
+  referring_ids = set(m[2] for m in markables.values())
+  element_of = {}
+  for markable_id, plural_ids in key_doc['element_of'].items():
+    if markable_id in markables and rng.random() >= error:
+      element_of[markable_id] = [e for e in plural_ids if e in referring_ids]
+  # the merged clusters may have made a member entity plural itself, the
+  # split-antecedents of the reader must not have cycles
+  plural_ids = set(e for plural_ids in element_of.values() for e in plural_ids)
+  element_of = {m: e for m, e in element_of.items() if e and markables[m][2] not in plural_ids}
+
+  bridging = {}
+  for anaphor, antecedent in key_doc['bridging'].items():
+    if anaphor in markables and antecedent in markables and rng.random() >= error:
+      if rng.random() < error * 0.5:
+        antecedent = rng.choice(sorted(markables))
+      if antecedent != anaphor:
+        bridging[anaphor] = antecedent
+
+  discourse_deixis = {}
+  for markable_id, (start, end, entity_id) in key_doc['discourse_deixis'].items():
+    if rng.random() >= error * 0.3:
+      if start != end and rng.random() < error * 0.5:
+        # only a part of the antecedent sentence
+        start = rng.randint(start, end)
+      discourse_deixis[markable_id] = (start, end, entity_id)
+
+  return {'name': key_doc['name'], 'tokens': tokens_num, 'sentence_length': sentence_length,
+      'markables': {m: (s, e, entity_id, None) for m, (s, e, entity_id) in markables.items()},
+      'element_of': element_of, 'bridging': bridging, 'discourse_deixis': discourse_deixis}
+
+
+def get_markable_column(tokens_num, markables, features):
+  """The cells of a markable column of the UA format, with the features of
+  each markable_id given by features."""
+  opens = [[] for _ in range(tokens_num)]
+  closes = [0] * tokens_num
+  # the outer markables are opened first
+  for markable_id, (start, end) in sorted(markables.items(), key=lambda m: (m[1][0], -m[1][1])):
+    opens[start].append('(%s%s' % (features[markable_id], ')' if start == end else ''))
+    if start != end:
+      closes[end] += 1
+  return [')' * closes[i] + ''.join(opens[i]) or '_' for i in range(tokens_num)]
+
+
+def write_ua(path, docs):
+  with open(path, 'w') as f:
+    f.write(UA_COLUMNS + '\n')
+    for doc in docs:
+      features = {}
+      for markable_id, (start, end, entity_id, MIN) in doc['markables'].items():
+        features[markable_id] = 'EntityID=%s|MarkableID=%s' % (entity_id, markable_id)
+        if MIN is not None:
+          features[markable_id] += ('|Min=%d' % (MIN[0] + 1) if MIN[0] == MIN[1]
+              else '|Min=%d,%d' % (MIN[0] + 1, MIN[1] + 1))
+        if markable_id in doc['element_of']:
+          features[markable_id] += '|ElementOf=' + ','.join(doc['element_of'][markable_id])
+      identity = get_markable_column(doc['tokens'],
+          {m: markable[:2] for m, markable in doc['markables'].items()}, features)
+      discourse_deixis = get_markable_column(doc['tokens'],
+          {m: markable[:2] for m, markable in doc['discourse_deixis'].items()},
+          {m: 'EntityID=%s|MarkableID=%s' % (markable[2], m) for m, markable in doc['discourse_deixis'].items()})
+      bridging = ['_'] * doc['tokens']
+      for anaphor, antecedent in sorted(doc['bridging'].items()):
+        start = doc['markables'][anaphor][0]
+        bridging[start] = bridging[start].strip('_') + '(MarkableID=%s|MentionAnchor=%s)' % (anaphor, antecedent)
+
+      f.write('# newdoc id = %s\n' % doc['name'])
+      for i in range(doc['tokens']):
+        if i % doc['sentence_length'] == 0:
+          f.write('# sent_id = %s-%d\n' % (doc['name'], i // doc['sentence_length'] + 1))
+        f.write('%d\tw%d\t_\t_\t_\t_\t_\t_\t_\t_\t%s\t%s\t%s\n' % (i + 1, i, identity[i], bridging[i],
+            discourse_deixis[i]))
+        if (i + 1) % doc['sentence_length'] == 0:
+          f.write('\n')
+
+
+def write_conll(path, docs):
+  """Writes the referring identity clusters in the CoNLL-2012 format."""
+  with open(path, 'w') as f:
+    for doc in docs:
+      entity_numbers = {}
+      opens = [[] for _ in range(doc['tokens'])]
+      closes = [[] for _ in range(doc['tokens'])]
+      singles = [[] for _ in range(doc['tokens'])]
+      for markable_id, (start, end, entity_id, _) in sorted(doc['markables'].items(), key=lambda m: m[1][:2]):
+        if entity_id.endswith('-Pseudo'):
+          continue
+        number = entity_numbers.setdefault(entity_id, len(entity_numbers))
+        if start == end:
+          singles[start].append('(%d)' % number)
+        else:
+          opens[start].append('(%d' % number)
+          closes[end].append('%d)' % number)
+
+      f.write('#begin document (%s); part 000\n' % doc['name'])
+      for i in range(doc['tokens']):
+        coref = '|'.join(opens[i] + singles[i] + closes[i]) or '-'
+        f.write('%s\t0\t%d\tw%d\t%s\n' % (doc['name'], i % doc['sentence_length'], i, coref))
+        if (i + 1) % doc['sentence_length'] == 0:
+          f.write('\n')
+      f.write('#end document\n')
+
+
+def add_config_arguments(parser, exclude=()):
+  """Adds a --name value option of every key of DEFAULT_CONFIG to the
+  argparse parser."""
+  for name, default in DEFAULT_CONFIG.items():
+    if name not in exclude:
+      parser.add_argument('--' + name.replace('_', '-'), dest=name, type=type(default), default=default)
+
+
+def get_config(args):
+  """The config of the options of add_config_arguments of the parsed args."""
+  return {name: getattr(args, name, default) for name, default in DEFAULT_CONFIG.items()}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Writes a synthetic key and system corpus.')
+  parser.add_argument('key_file')
+  parser.add_argument('sys_file')
+  parser.add_argument('format', nargs='?', choices=['ua', 'conll'], default='ua')
+  add_config_arguments(parser)
+  args = parser.parse_args()
+  key_docs, sys_docs = generate(get_config(args))
+  write = write_conll if args.format == 'conll' else write_ua
+  write(args.key_file, key_docs)
+  write(args.sys_file, sys_docs)
+
+
+if __name__ == '__main__':
+  main()
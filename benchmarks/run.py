@@ -0,0 +1,135 @@
+"""Times the reader and every metric on synthetic corpora of several sizes.
+
+python -m benchmarks.run [output_file] [--documents 20] [--mentions 50,200,800]
+    [--repeat 3] [--baseline baseline_file] [--<option of benchmarks.generate> value]
+
+The corpora of every combination of the --documents and --mentions values
+are generated with benchmarks.generate. The best time of --repeat runs of
+every stage is written as JSON to output_file (benchmarks.json by default),
+together with the stage timers and counters of coval.profiling. With
+--baseline the times are compared to those of an earlier output file, e.g.
+of the code before a change.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy
+import scipy
+
+from benchmarks import generate
+from coval import profiling
+from coval.eval import evaluator
+from coval.ua import reader
+from coval.ua import scorer
+
+METRICS = list(scorer.METRICS.items())
+
+
+def benchmark(config, repeat=3):
+  """Returns the best times in seconds of reading and scoring the corpus of
+  config, and the profile of one more run."""
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    key_file, sys_file = os.path.join(tmp_dir, 'key'), os.path.join(tmp_dir, 'sys')
+    key_docs, sys_docs = generate.generate(config)
+    generate.write_ua(key_file, key_docs)
+    generate.write_ua(sys_file, sys_docs)
+
+    times = {}
+    def run(name, function, *args):
+      best = float('inf')
+      for _ in range(repeat):
+        start = time.perf_counter()
+        # the reader reports e.g. skipped bridging pairs
+        with contextlib.redirect_stdout(io.StringIO()):
+          result = function(*args)
+        best = min(best, time.perf_counter() - start)
+      times[name] = best
+      return result
+
+    def read(use_MIN=False, evaluate_discourse_deixis=False):
+      return reader.get_coref_infos(key_file, sys_file, True, True, not evaluate_discourse_deixis,
+          not evaluate_discourse_deixis, evaluate_discourse_deixis, use_MIN)
+
+    def score():
+      doc_coref_infos, doc_non_referring_infos, doc_bridging_infos = read()
+      evaluator.evaluate_metrics(doc_coref_infos, METRICS)
+      evaluator.evaluate_non_referrings(doc_non_referring_infos)
+      evaluator.evaluate_bridgings(doc_bridging_infos)
+
+    doc_coref_infos, doc_non_referring_infos, doc_bridging_infos = run('read', read)
+    run('read MIN', read, True)
+    run('read discourse deixis', read, False, True)
+    for name, metric in METRICS:
+      run(name, evaluator.evaluate_documents, doc_coref_infos, metric)
+    run('all metrics', evaluator.evaluate_metrics, doc_coref_infos, METRICS)
+    run('non-referring', evaluator.evaluate_non_referrings, doc_non_referring_infos)
+    run('bridging', evaluator.evaluate_bridgings, doc_bridging_infos)
+
+    profiling.enable()
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        score()
+      profile = profiling.get_report()
+    finally:
+      profiling.disable()
+  return times, profile
+
+
+def compare(results, baseline_results):
+  """Prints the times of the results relative to those of the same configs
+  in the baseline results."""
+  baseline_times = {json.dumps(result['config'], sort_keys=True): result['times']
+      for result in baseline_results}
+  print('%-24s %-22s %12s %12s %8s' % ('corpus', 'stage', 'baseline (s)', 'current (s)', 'ratio'))
+  for result in results:
+    times = baseline_times.get(json.dumps(result['config'], sort_keys=True))
+    if times is None:
+      continue
+    corpus = '%d docs x %d mentions' % (result['config']['documents'], result['config']['mentions'])
+    for name, seconds in result['times'].items():
+      if name in times:
+        print('%-24s %-22s %12.4f %12.4f %8.2f' % (corpus, name, times[name], seconds,
+            seconds / times[name] if times[name] else float('nan')))
+
+
+def get_values(values):
+  return [int(value) for value in values.split(',')]
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Times the reader and the metrics on synthetic corpora.')
+  parser.add_argument('output_file', nargs='?', default='benchmarks.json')
+  parser.add_argument('--documents', type=get_values, default=[20])
+  parser.add_argument('--mentions', type=get_values, default=[50, 200, 800])
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--baseline')
+  generate.add_config_arguments(parser, exclude=('documents', 'mentions'))
+  args = parser.parse_args()
+  config = generate.get_config(args)
+
+  results = []
+  for documents, mentions in itertools.product(args.documents, args.mentions):
+    size_config = dict(config, documents=documents, mentions=mentions)
+    times, profile = benchmark(size_config, args.repeat)
+    results.append({'config': size_config, 'times': times, 'profile': profile})
+    print('%d docs x %d mentions: %s' % (documents, mentions,
+        ', '.join('%s %.4fs' % (name, seconds) for name, seconds in times.items())))
+
+  with open(args.output_file, 'w') as f:
+    json.dump({'python': platform.python_version(), 'numpy': numpy.__version__,
+        'scipy': scipy.__version__, 'platform': platform.platform(), 'results': results}, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+  main()
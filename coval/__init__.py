@@ -1 +1 @@
-
+from coval.ua.scorer import score, score_matrix, Scorer
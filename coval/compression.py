@@ -0,0 +1,68 @@
+"""Transparent reading of compressed key and system files.
+
+Files compressed with gzip, xz or zstandard are recognized by their magic
+bytes, whatever their name, and decompressed while they are read, so they
+never have to be decompressed to disk first:
+
+  from coval import compression
+  with compression.open_file(path) as f:
+    for line in f:
+      ...
+
+zstandard files need the zstandard package (or Python 3.14's
+compression.zstd).
+"""
+import gzip
+import io
+import lzma
+
+# the decompressed data is read in large blocks, so the line parser does not
+# pay for a call into the decompressor per line
+BUFFER_SIZE = 1 << 20
+
+MAGIC_BYTES = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'(\xb5/\xfd', 'zstd')]
+
+
+def get_compression(path):
+  """Returns 'gzip', 'xz' or 'zstd' for a compressed file, None otherwise."""
+  with open(path, 'rb') as f:
+    magic = f.read(max(len(magic) for magic, _ in MAGIC_BYTES))
+  for prefix, compression in MAGIC_BYTES:
+    if magic.startswith(prefix):
+      return compression
+  return None
+
+
+def open_file(path, mode='rb'):
+  """Opens the file for reading in binary ('rb') or text ('r') mode,
+  decompressing it if it is compressed. As with open, text is decoded with
+  the preferred encoding of the locale."""
+  if mode not in ('rb', 'r'):
+    raise ValueError('Compressed files can only be read, not opened with mode %r' % mode)
+  compression = get_compression(path)
+  if compression is None:
+    return open(path, mode)
+  f = io.BufferedReader(open_decompressed(path, compression), buffer_size=BUFFER_SIZE)
+  return f if mode == 'rb' else io.TextIOWrapper(f)
+
+
+def open_decompressed(path, compression):
+  if compression == 'gzip':
+    return gzip.open(path, 'rb')
+  if compression == 'xz':
+    return lzma.open(path, 'rb')
+  try:
+    from compression import zstd
+    return zstd.open(path, 'rb')
+  except ImportError:
+    pass
+  try:
+    import zstandard
+  except ImportError:
+    raise ImportError('Reading the zstandard file %s needs the zstandard package: '
+        'pip install zstandard' % path)
+  return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=BUFFER_SIZE,
+      closefd=True)
@@ -1,5 +1,6 @@
 import sys
 from coval.conll import mention
+from coval import compression
 
 
 def get_doc_mentions(doc_name, doc_lines, keep_singletons,
@@ -307,7 +308,7 @@ def get_doc_lines(file_name):
     doc_lines = {}
     doc_name = None
 
-    with open(file_name) as f:
+    with compression.open_file(file_name, 'r') as f:
         new_sentence = True
         for line in f:
             if line.startswith("#begin document"):
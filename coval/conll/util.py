@@ -1,3 +1,6 @@
+from coval import compression
+
+
 def parse_key_file(key_file):
         try:
                 from nltk.parse.stanford import StanfordParser
@@ -5,7 +8,7 @@ def parse_key_file(key_file):
                 print("Starting to parse key_file!")
                 print("This might take a while...")
                 new_file = open(key_file + ".parsed","w")
-                with open(key_file) as f:
+                with compression.open_file(key_file, 'r') as f:
                         tmp_sentence = [[]]
                         tmp_conll_lines = []
                         for line in f:
@@ -66,7 +69,7 @@ def parse_key_file(key_file):
 
 def check_gold_parse_annotation(key_file):
     has_gold_parse = False
-    with open(key_file) as f:
+    with compression.open_file(key_file, 'r') as f:
         for line in f:
             if not line.startswith("#"):
                 if len(line.split())> 6:
@@ -1,10 +1,13 @@
 """Some parts are borrowed from
 https://github.com/clarkkev/deep-coref/blob/master/evaluation.py
 """
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 from coval.ua import markable
+from coval import profiling
 
 
 def f1(p_num, p_den, r_num, r_den, beta=1):
@@ -14,46 +17,55 @@ def f1(p_num, p_den, r_num, r_den, beta=1):
       else (1 + beta * beta) * p * r / (beta * beta * p + r))
 
 def evaluate_bridgings(doc_bridging_infos):
+  counts = [0] * 9
+  for doc_id in doc_bridging_infos:
+    for i, count in enumerate(get_bridging_counts(*doc_bridging_infos[doc_id])):
+      counts[i] += count
+  return get_bridging_scores(counts)
+
+def get_bridging_counts(key_bridging_pairs, sys_bridging_pairs, mention_to_gold):
   tp_ar, fp_ar, fn_ar = 0,0,0 #anaphora recognation
   tp_fbm, fp_fbm, fn_fbm = 0,0,0 #full bridging at mention level
   tp_fbe, fp_fbe, fn_fbe = 0,0,0 #full bridging at entity level
-  for doc_id in doc_bridging_infos:
-    key_bridging_pairs, sys_bridging_pairs, mention_to_gold = doc_bridging_infos[doc_id]
-    for k_ana in key_bridging_pairs:
-      if k_ana in sys_bridging_pairs:
-        tp_ar+=1
-        k_ant = key_bridging_pairs[k_ana]
-        s_ant = sys_bridging_pairs[k_ana]
-
-        if k_ant == s_ant:
-          tp_fbe+=1
-          tp_fbm+=1
-        else:
-          fn_fbm+=1
-          #k_ant in mention_to_gold is used for bridging ant is actually non-referring,
-          # in this case the ant will not in mention_to_gold, but non-referring always
-          # is singleton so k_ant == s_ant already checked the correction.
-          if s_ant in mention_to_gold and k_ant in mention_to_gold and mention_to_gold[k_ant] == mention_to_gold[s_ant]:
-            tp_fbe+=1
-          else:
-            fn_fbe+=1
+  for k_ana in key_bridging_pairs:
+    if k_ana in sys_bridging_pairs:
+      tp_ar+=1
+      k_ant = key_bridging_pairs[k_ana]
+      s_ant = sys_bridging_pairs[k_ana]
+
+      if k_ant == s_ant:
+        tp_fbe+=1
+        tp_fbm+=1
       else:
-        fn_ar+=1
-        fn_fbe+=1
         fn_fbm+=1
-
-    for s_ana in sys_bridging_pairs:
-      if s_ana not in key_bridging_pairs:
-        fp_ar+=1
-        fp_fbe+=1
+        #k_ant in mention_to_gold is used for bridging ant is actually non-referring,
+        # in this case the ant will not in mention_to_gold, but non-referring always
+        # is singleton so k_ant == s_ant already checked the correction.
+        if s_ant in mention_to_gold and k_ant in mention_to_gold and mention_to_gold[k_ant] == mention_to_gold[s_ant]:
+          tp_fbe+=1
+        else:
+          fn_fbe+=1
+    else:
+      fn_ar+=1
+      fn_fbe+=1
+      fn_fbm+=1
+
+  for s_ana in sys_bridging_pairs:
+    if s_ana not in key_bridging_pairs:
+      fp_ar+=1
+      fp_fbe+=1
+      fp_fbm+=1
+    else:
+      s_ant = sys_bridging_pairs[s_ana]
+      k_ant = key_bridging_pairs[s_ana]
+      if not s_ant == k_ant:
         fp_fbm+=1
-      else:
-        s_ant = sys_bridging_pairs[s_ana]
-        k_ant = key_bridging_pairs[s_ana]
-        if not s_ant == k_ant:
-          fp_fbm+=1
-          if s_ant not in mention_to_gold or k_ant not in mention_to_gold or not mention_to_gold[s_ant] == mention_to_gold[k_ant]:
-            fp_fbe+=1
+        if s_ant not in mention_to_gold or k_ant not in mention_to_gold or not mention_to_gold[s_ant] == mention_to_gold[k_ant]:
+          fp_fbe+=1
+  return tp_ar, fp_ar, fn_ar, tp_fbm, fp_fbm, fn_fbm, tp_fbe, fp_fbe, fn_fbe
+
+def get_bridging_scores(counts):
+  tp_ar, fp_ar, fn_ar, tp_fbm, fp_fbm, fn_fbm, tp_fbe, fp_fbe, fn_fbe = counts
   recall_ar = tp_ar / float(tp_ar + fn_ar) if (tp_ar + fn_ar) > 0 else 0
   precision_ar = tp_ar / float(tp_ar + fp_ar) if (tp_ar + fp_ar) > 0 else 0
   f1_ar = (2 * recall_ar * precision_ar / (recall_ar + precision_ar)
@@ -71,20 +83,26 @@ def evaluate_bridgings(doc_bridging_infos):
   return (recall_ar, precision_ar, f1_ar), (recall_fbm, precision_fbm, f1_fbm), (recall_fbe, precision_fbe, f1_fbe)
 
 def evaluate_non_referrings(doc_non_referring_infos):
-  tp, _tn, fp, fn = 0, 0, 0, 0
-
+  counts = [0] * 3
   for doc_id in doc_non_referring_infos:
-    key_non_referrings, sys_non_referrings = doc_non_referring_infos[
-        doc_id]
-    for m in key_non_referrings:
-      if m in sys_non_referrings:
-        tp += 1
-      else:
-        fn += 1
-    for m in sys_non_referrings:
-      if m not in key_non_referrings:
-        fp += 1
-
+    for i, count in enumerate(get_non_referring_counts(*doc_non_referring_infos[doc_id])):
+      counts[i] += count
+  return get_non_referring_scores(counts)
+
+def get_non_referring_counts(key_non_referrings, sys_non_referrings):
+  tp, fp, fn = 0, 0, 0
+  for m in key_non_referrings:
+    if m in sys_non_referrings:
+      tp += 1
+    else:
+      fn += 1
+  for m in sys_non_referrings:
+    if m not in key_non_referrings:
+      fp += 1
+  return tp, fp, fn
+
+def get_non_referring_scores(counts):
+  tp, fp, fn = counts
   recall = tp / float(tp + fn) if (tp + fn) > 0 else 0
   precision = tp / float(tp + fp) if (tp + fp) > 0 else 0
   f1 = (2 * recall * precision / (recall + precision)
@@ -111,55 +129,70 @@ class Evaluator:
       self.aggregated_r_num = []
       self.aggregated_r_den = []
   
-  def align_split_antecedents(self, key_clusters, sys_clusters):
-    key_split_antecedents = [m for cl in key_clusters for m in cl if is_split_antecedent(m)]
-    sys_split_antecedents = [m for cl in sys_clusters for m in cl if is_split_antecedent(m)]
-
-    if len(key_split_antecedents) == 0 and len(sys_split_antecedents) == 0:
-      return {}, {}, {}
-
-    if len(key_split_antecedents) == 0:
-      key_split_antecedents.append(markable.get_dummy_split_antecedent())
-
-    if len(sys_split_antecedents) == 0:
-      sys_split_antecedents.append(markable.get_dummy_split_antecedent())
-
-    key_clusters = [list(s_ant.split_antecedent_members) for s_ant in key_split_antecedents]
-    sys_clusters = [list(s_ant.split_antecedent_members) for s_ant in sys_split_antecedents]
-    sys_mention_key_clusters = [{m:cid for cid, cl in enumerate(clusters) for m in cl} for clusters in key_clusters]
-    key_mention_sys_clusters = [{m:cid for cid, cl in enumerate(clusters) for m in cl} for clusters in sys_clusters]
-
-    f_scores = np.zeros((len(key_split_antecedents), len(sys_split_antecedents)))
-    recalls = np.zeros((len(key_split_antecedents), len(sys_split_antecedents)))
-    precisions = np.zeros((len(key_split_antecedents), len(sys_split_antecedents)))
-    raw_numbers = np.zeros((len(key_split_antecedents), len(sys_split_antecedents), 4)) #
-    for i in range(len(key_split_antecedents)):
-      key_cluster = key_clusters[i]
-      sys_mention_key_cluster = sys_mention_key_clusters[i]
-      for j in range(len(sys_split_antecedents)):
-        sys_cluster = sys_clusters[j]
-        key_mention_sys_cluster = key_mention_sys_clusters[j]
-        pn, pd, rn, rd = self.__update__(key_cluster, sys_cluster,key_mention_sys_cluster,sys_mention_key_cluster,is_split_alignment=True)
-        raw_numbers[i,j,:] = [pn, pd, rn, rd]
-        precisions[i,j] = 0 if pn == 0 else pn / float(pd)
-        recalls[i,j] = 0 if rn == 0 else rn / float(rd)
-        f_scores[i,j] = f1(pn, pd, rn, rd)
-    row_ind, col_ind = linear_sum_assignment(-f_scores)
-
+  def align_split_antecedents(self, key_clusters, sys_clusters, split_antecedent_info=None):
+    if split_antecedent_info is None:
+      split_antecedent_info = get_split_antecedent_info(key_clusters, sys_clusters)
+    if split_antecedent_info is None:
+      return {}, {}, {}, (0, 0, 0, 0)
+
+    (key_split_antecedents, sys_split_antecedents, key_clusters, sys_clusters,
+        sys_mention_key_clusters, key_mention_sys_clusters, overlapping_pairs) = split_antecedent_info
+
+    # the denominators only depend on one side, so they are those of the
+    # split-antecedent against nothing
+    pds = [self.__update__([], sys_clusters[j], {}, {}, is_split_alignment=True)[1]
+        for j in range(len(sys_split_antecedents))]
+    rds = [self.__update__(key_clusters[i], [], {}, {}, is_split_alignment=True)[3]
+        for i in range(len(key_split_antecedents))]
+
+    # the pairs without common members score zero, only the others are
+    # evaluated
+    pair_scores = {}
+    for i, j in overlapping_pairs:
+      pn, pd, rn, rd = self.__update__(key_clusters[i], sys_clusters[j], key_mention_sys_clusters[j],
+          sys_mention_key_clusters[i], is_split_alignment=True)
+      pair_scores[i, j] = (pn, rn, 0 if pn == 0 else pn / float(pd), 0 if rn == 0 else rn / float(rd),
+          f1(pn, pd, rn, rd))
+    profiling.count('split-antecedent pairs', len(pds) * len(rds))
+    profiling.count('split-antecedent pairs evaluated', len(overlapping_pairs))
+
+    positive = [cell for cell in overlapping_pairs if pair_scores[cell][4] > 0]
+    if len(set(i for i, _ in positive)) == len(positive) == len(set(j for _, j in positive)) \
+        and not any(pair_scores[cell][2] > 0 or pair_scores[cell][3] > 0
+            for cell in overlapping_pairs if pair_scores[cell][4] == 0):
+      # the positive pairs are one to one, so they are in every optimal
+      # assignment and the other pairs do not count
+      assignment = positive
+    else:
+      # the alignment of tied split-antecedents changes the scores, so this is
+      # left to linear_sum_assignment on the whole matrix as before
+      f_scores = np.zeros((len(key_split_antecedents), len(sys_split_antecedents)))
+      for cell in overlapping_pairs:
+        f_scores[cell] = pair_scores[cell][4]
+      assignment = list(zip(*linear_sum_assignment(-f_scores)))
+      profiling.count('split-antecedent assignment problems')
+      profiling.count('split-antecedent assignment cells', f_scores.size)
+
+    zero = (0, 0, 0, 0, 0)
+    assigned_scores = [pair_scores.get(cell, zero) for cell in assignment]
     #pn,pd,rn,rd
-    self.split_antecedent_counter[0] += raw_numbers[row_ind, col_ind, np.zeros_like(col_ind)].sum()
-    self.split_antecedent_counter[1] += raw_numbers[0, :, 1].sum()
-    self.split_antecedent_counter[2] += raw_numbers[row_ind, col_ind, np.ones_like(col_ind) * 2].sum()
-    self.split_antecedent_counter[3] += raw_numbers[:, 0, 3].sum()
-
+    split_antecedent_counts = (np.array([pn for pn, _, _, _, _ in assigned_scores], dtype=float).sum(),
+        np.array(pds, dtype=float).sum(),
+        np.array([rn for _, rn, _, _, _ in assigned_scores], dtype=float).sum(),
+        np.array(rds, dtype=float).sum())
+
+    recalls = {cell: score[3] for cell, score in zip(assignment, assigned_scores)}
+    precisions = {cell: score[2] for cell, score in zip(assignment, assigned_scores)}
+    f_scores = {cell: score[4] for cell, score in zip(assignment, assigned_scores)}
     key_split_antecedent_sys_r = {key_split_antecedents[r]: (sys_split_antecedents[c], float(recalls[r, c]))
-                                  for r, c in zip(row_ind, col_ind) if recalls[r, c] > 0}
+                                  for r, c in assignment if recalls[r, c] > 0}
     sys_split_antecedent_key_p = {sys_split_antecedents[c]: (key_split_antecedents[r], float(precisions[r, c]))
-                                  for r, c in zip(row_ind, col_ind) if precisions[r, c] > 0}
+                                  for r, c in assignment if precisions[r, c] > 0}
     key_split_antecedent_sys_f = {key_split_antecedents[r]: (sys_split_antecedents[c], float(f_scores[r, c]))
-                                  for r, c in zip(row_ind, col_ind) if f_scores[r, c] > 0}
+                                  for r, c in assignment if f_scores[r, c] > 0}
 
-    return key_split_antecedent_sys_r, sys_split_antecedent_key_p, key_split_antecedent_sys_f
+    return (key_split_antecedent_sys_r, sys_split_antecedent_key_p, key_split_antecedent_sys_f,
+        split_antecedent_counts)
 
   def __update__(self, key_clusters, sys_clusters,
                  key_mention_sys_cluster, sys_mention_key_cluster,
@@ -194,23 +227,46 @@ class Evaluator:
 
     return pn, pd, rn, rd
 
-  def update(self, coref_info):
+  def update(self, coref_info, split_antecedent_info=None):
+    self.add_document_counts(self.get_document_counts(coref_info, split_antecedent_info))
+
+  def get_document_counts(self, coref_info, split_antecedent_info=None):
+    """Scores one document without updating the evaluator, returns
+    (pn, pd, rn, rd, split_antecedent_counts) for add_document_counts."""
     (key_clusters, sys_clusters, key_mention_sys_cluster,
         sys_mention_key_cluster) = coref_info
 
-    key_split_antecedent_sys_r, sys_split_antecedent_key_p, key_split_antecedent_sys_f \
-      = self.align_split_antecedents(key_clusters, sys_clusters)
-
-    pn, pd, rn, rd = self.__update__(key_clusters,sys_clusters,
-                                     key_mention_sys_cluster,
-                                     sys_mention_key_cluster,
-                                     key_split_antecedent_sys_r,
-                                     sys_split_antecedent_key_p,
-                                     key_split_antecedent_sys_f)
+    metric_name = self.metric.__name__
+    with profiling.stage('split-antecedent alignment (%s)' % metric_name):
+      key_split_antecedent_sys_r, sys_split_antecedent_key_p, key_split_antecedent_sys_f, \
+        split_antecedent_counts = self.align_split_antecedents(key_clusters, sys_clusters, split_antecedent_info)
+
+    if profiling.enabled:
+      key_mention_sys_cluster = LookupCounter(key_mention_sys_cluster)
+      sys_mention_key_cluster = LookupCounter(sys_mention_key_cluster)
+    with profiling.stage('metric %s' % metric_name):
+      pn, pd, rn, rd = self.__update__(key_clusters,sys_clusters,
+                                       key_mention_sys_cluster,
+                                       sys_mention_key_cluster,
+                                       key_split_antecedent_sys_r,
+                                       sys_split_antecedent_key_p,
+                                       key_split_antecedent_sys_f)
+    if profiling.enabled:
+      lookups = key_mention_sys_cluster.lookups + sys_mention_key_cluster.lookups
+      if lookups:
+        profiling.count('mention lookups (%s)' % metric_name, lookups)
+        profiling.count('mention lookup hits (%s)' % metric_name,
+            key_mention_sys_cluster.hits + sys_mention_key_cluster.hits)
+    return pn, pd, rn, rd, split_antecedent_counts
+
+  def add_document_counts(self, document_counts):
+    pn, pd, rn, rd, split_antecedent_counts = document_counts
     self.p_num += pn
     self.p_den += pd
     self.r_num += rn
     self.r_den += rd
+    for i, count in enumerate(split_antecedent_counts):
+      self.split_antecedent_counter[i] += count
 
     if self.keep_aggregated_values:
       self.aggregated_p_num.append(pn)
@@ -248,13 +304,78 @@ class Evaluator:
         self.aggregated_r_num, self.aggregated_r_den)
 
 
-def evaluate_documents(doc_coref_infos, metric, beta=1, lea_split_antecedent_importance=1, only_split_antecedent = False):
+class LookupCounter(dict):
+  """A mention to cluster dict that counts the lookups of the metrics in it
+  and how many of them find the mention, used while profiling."""
+
+  def __init__(self, mention_to_cluster):
+    dict.__init__(self, mention_to_cluster)
+    self.lookups = 0
+    self.hits = 0
+
+  def __contains__(self, m):
+    self.lookups += 1
+    found = dict.__contains__(self, m)
+    self.hits += found
+    return found
+
+  def __getitem__(self, m):
+    self.lookups += 1
+    value = dict.__getitem__(self, m)
+    self.hits += 1
+    return value
+
+  def get(self, m, default=None):
+    self.lookups += 1
+    if dict.__contains__(self, m):
+      self.hits += 1
+      return dict.__getitem__(self, m)
+    return default
+
+
+def get_split_antecedent_info(key_clusters, sys_clusters):
+  """The metric independent part of align_split_antecedents: the split-antecedents
+  of both sides with their member clusters and mention maps, or None if there
+  is nothing to align."""
+  key_split_antecedents = [m for cl in key_clusters for m in cl if is_split_antecedent(m)]
+  sys_split_antecedents = [m for cl in sys_clusters for m in cl if is_split_antecedent(m)]
+
+  if len(key_split_antecedents) == 0 and len(sys_split_antecedents) == 0:
+    return None
+
+  if len(key_split_antecedents) == 0:
+    key_split_antecedents.append(markable.get_dummy_split_antecedent())
+
+  if len(sys_split_antecedents) == 0:
+    sys_split_antecedents.append(markable.get_dummy_split_antecedent())
+
+  key_member_clusters = [list(s_ant.split_antecedent_members) for s_ant in key_split_antecedents]
+  sys_member_clusters = [list(s_ant.split_antecedent_members) for s_ant in sys_split_antecedents]
+  sys_mention_key_clusters = [{m:cid for cid, cl in enumerate(clusters) for m in cl} for clusters in key_member_clusters]
+  key_mention_sys_clusters = [{m:cid for cid, cl in enumerate(clusters) for m in cl} for clusters in sys_member_clusters]
+
+  # the pairs of key and system split-antecedents with a common member
+  # markable; all the metrics score the other pairs zero
+  key_split_antecedent_ids = defaultdict(list)
+  for i, mention_key_cluster in enumerate(sys_mention_key_clusters):
+    for m in mention_key_cluster:
+      key_split_antecedent_ids[m].append(i)
+  overlapping_pairs = sorted(set((i, j) for j, mention_sys_cluster in enumerate(key_mention_sys_clusters)
+      for m in mention_sys_cluster for i in key_split_antecedent_ids.get(m, ())))
+  return (key_split_antecedents, sys_split_antecedents, key_member_clusters, sys_member_clusters,
+      sys_mention_key_clusters, key_mention_sys_clusters, overlapping_pairs)
+
+
+def get_evaluators(metric, beta=1, lea_split_antecedent_importance=1):
+  #blanc is given as a list of sub-metrics, each of them has its own evaluator
+  sub_metrics = metric if isinstance(metric, list) else [metric]
+  return [Evaluator(sub_metric, beta=beta, lea_split_antecedent_importance=lea_split_antecedent_importance)
+      for sub_metric in sub_metrics]
+
+
+def get_scores(metric, evaluators, only_split_antecedent=False):
   if isinstance(metric, list):
     #for blanc
-    evaluators = [Evaluator(sub_metric,beta=beta,lea_split_antecedent_importance=lea_split_antecedent_importance) for sub_metric in metric]
-    for doc_id in doc_coref_infos:
-      for evaluator in evaluators:
-        evaluator.update(doc_coref_infos[doc_id])
     p, r, f, cnt = 0,0,0,0
     for evaluator in evaluators:
       pn,pd,rn,rd = evaluator.get_counts()
@@ -271,10 +392,7 @@ def evaluate_documents(doc_coref_infos, metric, beta=1, lea_split_antecedent_imp
     else:
       return (r/cnt, p/cnt, f/cnt)
   else:
-    evaluator = Evaluator(metric, beta=beta,lea_split_antecedent_importance=lea_split_antecedent_importance)
-    for doc_id in doc_coref_infos:
-      # print(doc_id)
-      evaluator.update(doc_coref_infos[doc_id])
+    evaluator = evaluators[0]
     if only_split_antecedent:
       p, r, f = evaluator.get_split_antecedent_prf()
       return r,p,f
@@ -283,6 +401,93 @@ def evaluate_documents(doc_coref_infos, metric, beta=1, lea_split_antecedent_imp
         evaluator.get_f1())
 
 
+def evaluate_documents(doc_coref_infos, metric, beta=1, lea_split_antecedent_importance=1, only_split_antecedent = False,
+    workers=1):
+  return evaluate_metrics(doc_coref_infos, [(None, metric)], beta=beta,
+      lea_split_antecedent_importance=lea_split_antecedent_importance,
+      only_split_antecedent=only_split_antecedent, workers=workers)[0][1]
+
+
+def evaluate_metrics(doc_coref_infos, metrics, beta=1, lea_split_antecedent_importance=1, only_split_antecedent=False,
+    workers=1, document_counts=None):
+  """Evaluates a list of (name, metric) pairs in a single pass over the documents
+  and returns a list of (name, (recall, precision, f1)). The split-antecedent
+  info of each document is built once and shared by all the metrics.
+  doc_coref_infos is either a dict or an iterable of coref infos, e.g. a
+  generator that reads the documents while they are scored.
+  With workers > 1 the documents are scored by a process pool; the per-document
+  counts are added up in document order, so the scores are identical to the
+  serial ones.
+  If document_counts is a list, the counts of each document are appended to
+  it as in get_documents_counts, e.g. for the significance tests."""
+  coref_infos = doc_coref_infos.values() if isinstance(doc_coref_infos, dict) else doc_coref_infos
+  all_evaluators = [get_evaluators(metric, beta=beta, lea_split_antecedent_importance=lea_split_antecedent_importance)
+      for _, metric in metrics]
+  if workers > 1:
+    all_doc_counts = get_documents_counts_parallel(coref_infos,
+        [metric for _, metric in metrics], beta, lea_split_antecedent_importance, workers)
+  else:
+    all_doc_counts = iter_documents_counts(coref_infos, all_evaluators)
+  for doc_counts in all_doc_counts:
+    for evaluators, metric_counts in zip(all_evaluators, doc_counts):
+      for evaluator, counts in zip(evaluators, metric_counts):
+        evaluator.add_document_counts(counts)
+    if document_counts is not None:
+      document_counts.append(doc_counts)
+  return [(name, get_scores(metric, evaluators, only_split_antecedent))
+      for (name, metric), evaluators in zip(metrics, all_evaluators)]
+
+
+def get_documents_counts(coref_infos, metrics, beta=1, lea_split_antecedent_importance=1):
+  """The document counts of every evaluator of every metric, per document."""
+  all_evaluators = [get_evaluators(metric, beta=beta, lea_split_antecedent_importance=lea_split_antecedent_importance)
+      for metric in metrics]
+  return list(iter_documents_counts(coref_infos, all_evaluators))
+
+
+def iter_documents_counts(coref_infos, all_evaluators):
+  for coref_info in coref_infos:
+    with profiling.stage('split-antecedent info'):
+      split_antecedent_info = get_split_antecedent_info(coref_info[0], coref_info[1])
+    yield [[evaluator.get_document_counts(coref_info, split_antecedent_info)
+        for evaluator in evaluators] for evaluators in all_evaluators]
+
+
+def get_profiled_documents_counts(coref_infos, metrics, beta=1, lea_split_antecedent_importance=1):
+  """get_documents_counts in a worker process, with the profile of the
+  worker to be merged into the profile of the main process."""
+  profiling.enable()
+  doc_counts = get_documents_counts(coref_infos, metrics, beta, lea_split_antecedent_importance)
+  return doc_counts, profiling.get_state()
+
+
+def get_documents_counts_parallel(coref_infos, metrics, beta, lea_split_antecedent_importance, workers):
+  """Yields the get_documents_counts of each document in order. The documents
+  are sent to the pool in chunks and only a few chunks per worker are in
+  flight, so streamed documents are not all read up front. The documents
+  are parsed by the caller and pickled to the workers."""
+  # a few chunks per worker keeps the pool busy when document sizes differ
+  chunk_size = max(1, len(coref_infos) // (workers * 4)) if hasattr(coref_infos, '__len__') else 8
+  coref_infos = iter(coref_infos)
+  profile = profiling.enabled
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = deque()
+    while True:
+      chunk = list(islice(coref_infos, chunk_size))
+      if chunk:
+        futures.append(executor.submit(get_profiled_documents_counts if profile else get_documents_counts,
+            chunk, metrics, beta, lea_split_antecedent_importance))
+      if futures and (not chunk or len(futures) >= workers * 2):
+        chunk_counts = futures.popleft().result()
+        if profile:
+          chunk_counts, chunk_profile = chunk_counts
+          profiling.merge_state(chunk_profile)
+        for doc_counts in chunk_counts:
+          yield doc_counts
+      elif not chunk:
+        break
+
+
 def get_document_evaluations(doc_coref_infos, metric, beta=1):
   evaluator = Evaluator(metric, beta=beta, keep_aggregated_values=True)
   for doc_id in doc_coref_infos:
@@ -353,40 +558,93 @@ def muc(clusters, out_clusters, mention_to_gold, split_antecedent_to_gold={}, co
   return tp, p
 
 
-def phi4(c1, c2, split_antecedent_to_sys):
-  return 2 * phi3(c1,c2,split_antecedent_to_sys) / float(len(c1) + len(c2))
+def get_cluster_overlaps(gold_clusters, clusters, split_antecedent_to_sys={}):
+  """Sparse contingency table {(i, j): overlap} of the key and system clusters
+  that overlap, where a key split-antecedent adds its matching score to the
+  cells of its aligned system split-antecedent. It is built with one pass
+  over the mentions of each side."""
+  mention_to_clusters = defaultdict(list)
+  for j, c in enumerate(clusters):
+    for m in c:
+      cluster_ids = mention_to_clusters[m]
+      if not cluster_ids or cluster_ids[-1] != j:
+        cluster_ids.append(j)
 
-def phi3(c1, c2, split_antecedent_to_sys):
-  overlap = 0
-  for m in c1:
-    if is_split_antecedent(m):
-      if m in split_antecedent_to_sys:
-        gold_split_antecedent, matching_score = split_antecedent_to_sys[m]
-        if gold_split_antecedent in c2:
-          overlap += matching_score
-    elif m in c2:
-      overlap += 1
-  return overlap
+  overlaps = defaultdict(float)
+  for i, c in enumerate(gold_clusters):
+    for m in c:
+      if is_split_antecedent(m):
+        if m in split_antecedent_to_sys:
+          gold_split_antecedent, matching_score = split_antecedent_to_sys[m]
+          for j in mention_to_clusters.get(gold_split_antecedent, []):
+            overlaps[i, j] += matching_score
+      else:
+        for j in mention_to_clusters.get(m, []):
+          overlaps[i, j] += 1
+  return overlaps
+
+def get_sparse_max_assignment(scores):
+  """The maximum score assignment of a sparse matrix of non-negative scores
+  given as {(row, col): score}, i.e. linear_sum_assignment(-scores) without
+  the pairs of zero score; returns the assigned (row, col) pairs sorted by row.
+  The cells are split into the connected components of the rows and columns
+  they link; components of a single cell are one to one matches that are
+  assigned directly, and only the remaining ones are solved with the
+  Hungarian algorithm."""
+  cells = [cell for cell in scores if scores[cell] > 0]
+  if len(set(i for i, _ in cells)) == len(cells) == len(set(j for _, j in cells)):
+    return sorted(cells)
+
+  # union-find over the rows ('r', i) and columns ('c', j)
+  parent = {}
+  def find(node):
+    root = node
+    while parent.get(root, root) != root:
+      root = parent[root]
+    while node != root:
+      parent[node], node = root, parent[node]
+    return root
+  for i, j in cells:
+    root_i, root_j = find(('r', i)), find(('c', j))
+    if root_i != root_j:
+      parent[root_i] = root_j
+  components = defaultdict(list)
+  for i, j in cells:
+    components[find(('r', i))].append((i, j))
+
+  assignment = []
+  for component in components.values():
+    if len(component) == 1:
+      assignment.append(component[0])
+      continue
+    row_ids = sorted(set(i for i, _ in component))
+    col_ids = sorted(set(j for _, j in component))
+    component_scores = np.zeros((len(row_ids), len(col_ids)))
+    row_index = {i: r for r, i in enumerate(row_ids)}
+    col_index = {j: c for c, j in enumerate(col_ids)}
+    for i, j in component:
+      component_scores[row_index[i], col_index[j]] = scores[i, j]
+    profiling.count('ceaf assignment problems')
+    profiling.count('ceaf assignment cells', component_scores.size)
+    for r, c in zip(*linear_sum_assignment(-component_scores)):
+      if component_scores[r, c] > 0:
+        assignment.append((row_ids[r], col_ids[c]))
+  return sorted(assignment)
 
 def ceafe(clusters, gold_clusters,key_split_antecedent_sys_f={}):
   clusters = [c for c in clusters]
-  scores = np.zeros((len(gold_clusters), len(clusters)))
-  for i in range(len(gold_clusters)):
-    for j in range(len(clusters)):
-      scores[i, j] = phi4(gold_clusters[i], clusters[j],key_split_antecedent_sys_f)
-  row_ind, col_ind = linear_sum_assignment(-scores)
-  # print(scores,row_ind,col_ind)
-  similarity = scores[row_ind, col_ind].sum()
+  scores = get_cluster_overlaps(gold_clusters, clusters, key_split_antecedent_sys_f)
+  profiling.count('contingency cells (ceafe)', len(scores))
+  for i, j in scores:
+    scores[i, j] = 2 * scores[i, j] / float(len(gold_clusters[i]) + len(clusters[j]))
+  similarity = sum(scores[cell] for cell in get_sparse_max_assignment(scores))
   return similarity, len(clusters), similarity, len(gold_clusters)
 
 def ceafm(clusters, gold_clusters, key_split_antecedent_sys_f={}):
   clusters = [c for c in clusters]
-  scores = np.zeros((len(gold_clusters), len(clusters)))
-  for i in range(len(gold_clusters)):
-    for j in range(len(clusters)):
-      scores[i, j] = phi3(gold_clusters[i], clusters[j], key_split_antecedent_sys_f)
-  row_ind, col_ind = linear_sum_assignment(-scores)
-  similarity = scores[row_ind, col_ind].sum()
+  scores = get_cluster_overlaps(gold_clusters, clusters, key_split_antecedent_sys_f)
+  profiling.count('contingency cells (ceafm)', len(scores))
+  similarity = sum(scores[cell] for cell in get_sparse_max_assignment(scores))
 
   #corrected by juntao for ceafm the denominator is the number of mentions
   #return similarity, len(clusters), similarity, len(gold_clusters)
@@ -405,7 +663,18 @@ def lea(input_clusters, output_clusters, mention_to_gold, split_antecedent_to_go
         common_links = 1
       else:
         common_links = 0
+    elif not any(is_split_antecedent(m) for m in c):
+      # the common links are the pairs of mentions that are in the same
+      # output cluster
+      all_links = len(c) * (len(c) - 1) / 2.0
+      output_counts = defaultdict(int)
+      for m in c:
+        if m in mention_to_gold:
+          output_counts[mention_to_gold[m]] += 1
+      common_links = sum(n * (n - 1) // 2 for n in output_counts.values())
     else:
+      # the link scores of split-antecedents multiply, so these clusters are
+      # scored link by link
       common_links = 0
       all_links = len(c) * (len(c) - 1) / 2.0
       for i, m in enumerate(c):
@@ -438,18 +707,27 @@ def lea(input_clusters, output_clusters, mention_to_gold, split_antecedent_to_go
   return num, den
 
 
+def get_sys_cluster_and_weight(m, mention_to_sys, split_antecedent_to_sys_f):
+  link_score = 1
+  if is_split_antecedent(m) and m in split_antecedent_to_sys_f:
+    m, link_score = split_antecedent_to_sys_f[m]
+  return mention_to_sys.get(m), link_score
+
+
 def blancc(sys_clusters, key_clusters, mention_to_sys, split_antecedent_to_sys_f={}):
   num, pd, rd = 0, 0, 0
   for c in key_clusters:
+    # the common links (m, m2) with m before m2 in c; m is mapped to its aligned
+    # system split-antecedent while m2 is looked up as it is, so the later
+    # mentions are counted per system cluster while walking c backwards
     common_links = 0
-    for i, m in enumerate(c):
-      link_score = 1
-      if is_split_antecedent(m) and m in split_antecedent_to_sys_f:
-        m, link_score = split_antecedent_to_sys_f[m]
+    later_mentions = defaultdict(int)
+    for m in reversed(c):
+      sys_cluster, link_score = get_sys_cluster_and_weight(m, mention_to_sys, split_antecedent_to_sys_f)
+      if sys_cluster is not None:
+        common_links += link_score * later_mentions[sys_cluster]
       if m in mention_to_sys:
-        for m2 in c[i + 1:]:
-          if m2 in mention_to_sys and mention_to_sys[m] == mention_to_sys[m2]:
-            common_links += link_score
+        later_mentions[mention_to_sys[m]] += 1
 
     num += common_links
   rd = sum([len(c) * (len(c) - 1) / 2 for c in key_clusters])
@@ -459,22 +737,22 @@ def blancc(sys_clusters, key_clusters, mention_to_sys, split_antecedent_to_sys_f
 
 def blancn(sys_clusters, key_clusters, mention_to_sys, split_antecedent_to_sys_f={}):
   num, pd, rd = 0, 0, 0
-  for cid, c in enumerate(key_clusters):
-    common_links = 0
-    for i, m in enumerate(c):
-      link_score = 1
-      if is_split_antecedent(m) and m in split_antecedent_to_sys_f:
-        m, link_score = split_antecedent_to_sys_f[m]
-      if m in mention_to_sys:
-        for c2 in key_clusters[cid + 1:]:
-          for m2 in c2:
-            link_score2 = 1
-            if is_split_antecedent(m2) and m2 in split_antecedent_to_sys_f:
-              m2, link_score2 = split_antecedent_to_sys_f[m2]
-            if m2 in mention_to_sys and not mention_to_sys[m] == mention_to_sys[m2]:
-              common_links += link_score * link_score2
+  # a non-coreference link joins mentions of two different key clusters that are
+  # in different system clusters, so for every mention the links to the earlier
+  # key clusters are all their (weighted) mentions minus those in the same
+  # system cluster
+  earlier_total = 0
+  earlier_sys_clusters = defaultdict(int)
+  for c in key_clusters:
+    mentions = [get_sys_cluster_and_weight(m, mention_to_sys, split_antecedent_to_sys_f) for m in c]
+    for sys_cluster, link_score in mentions:
+      if sys_cluster is not None:
+        num += link_score * (earlier_total - earlier_sys_clusters[sys_cluster])
+    for sys_cluster, link_score in mentions:
+      if sys_cluster is not None:
+        earlier_total += link_score
+        earlier_sys_clusters[sys_cluster] += link_score
 
-    num += common_links
   num_key_mentions = sum([len(c) for c in key_clusters])
   num_sys_mentions = sum([len(c) for c in sys_clusters])
   rd = num_key_mentions * (num_key_mentions - 1) / 2 - sum([len(c) * (len(c) - 1) / 2 for c in key_clusters])
@@ -0,0 +1,126 @@
+"""Significance tests on the document level counts of the metrics.
+
+The counts of every document are computed once while scoring (see the
+document_counts argument of evaluator.evaluate_metrics) and kept in a NumPy
+array, the resamples of the tests only add up these counts with NumPy, so no
+document is read or scored again.
+"""
+import numpy as np
+
+
+def get_count_array(metrics, document_counts):
+  """Returns the document_counts of evaluate_metrics as an array of shape
+  (documents, evaluators, 8) with the pn, pd, rn, rd and the split-antecedent
+  pn, pd, rn, rd of each evaluator of each of the (name, metric) pairs."""
+  evaluators_num = sum(len(metric) if isinstance(metric, list) else 1 for _, metric in metrics)
+  counts = [[list(counts[:4]) + list(counts[4]) for metric_counts in doc_counts for counts in metric_counts]
+      for doc_counts in document_counts]
+  return np.array(counts, dtype=float).reshape(len(document_counts), evaluators_num, 8)
+
+
+def get_prf(counts, beta=1):
+  """The vectorized evaluator.f1 of the (..., 4) pn, pd, rn, rd counts."""
+  pn, pd, rn, rd = np.moveaxis(counts, -1, 0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    p = np.where(pn == 0, 0, pn / pd)
+    r = np.where(rn == 0, 0, rn / rd)
+    f = np.where(p + r == 0, 0, (1 + beta * beta) * p * r / (beta * beta * p + r))
+  return r, p, f
+
+
+def get_scores(metrics, counts, beta=1, only_split_antecedent=False):
+  """The vectorized evaluator.get_scores: returns [(name, (recall, precision,
+  f1))] of counts summed over the documents, of shape (..., evaluators, 8)."""
+  scores = []
+  start = 0
+  for name, metric in metrics:
+    evaluators_num = len(metric) if isinstance(metric, list) else 1
+    metric_counts = counts[..., start:start + evaluators_num, :]
+    start += evaluators_num
+    r, p, f = get_prf(metric_counts[..., 4:] if only_split_antecedent else metric_counts[..., :4], beta)
+    if isinstance(metric, list):
+      #for blanc, the average of the sub-metrics that have any links
+      used = (metric_counts[..., 1] != 0) | (metric_counts[..., 3] != 0)
+      used_num = used.sum(axis=-1)
+      r, p, f = [np.where(used_num == 0, 0, (score * used).sum(axis=-1) / np.maximum(used_num, 1))
+          for score in (r, p, f)]
+    else:
+      r, p, f = r[..., 0], p[..., 0], f[..., 0]
+    scores.append((name, (r, p, f)))
+  return scores
+
+
+def get_f1s(scores):
+  """Returns the names and the F1 scores of get_scores, with the CoNLL score
+  (the average F1 of muc, bcub and ceafe) if these are all evaluated."""
+  names = [name for name, _ in scores]
+  f1s = [f for _, (_, _, f) in scores]
+  conll = [f for name, (_, _, f) in scores if name in ["muc", "bcub", "ceafe"]]
+  if len(conll) == 3:
+    names.append('conll')
+    f1s.append(sum(conll) / 3)
+  return names, np.stack(f1s, axis=-1)
+
+
+def get_resample_weights(rng, resamples, documents_num):
+  """How often each document is drawn in each of the resamples, as a
+  (resamples, documents) matrix."""
+  indices = rng.integers(0, documents_num, (resamples, documents_num))
+  indices += documents_num * np.arange(resamples)[:, None]
+  return np.bincount(indices.ravel(), minlength=resamples * documents_num).reshape(
+      resamples, documents_num).astype(float)
+
+
+def bootstrap(metrics, counts, resamples=1000, confidence=0.95, beta=1, only_split_antecedent=False,
+    seed=0, batch_size=1000):
+  """Percentile bootstrap confidence intervals of the F1 scores over the
+  documents of counts (see get_count_array). Returns [(name, (lower, upper))]
+  including the CoNLL score. The resamples are drawn in batches of
+  batch_size, each batch is a single matrix product of the resample weights
+  and the document counts. Without any document the intervals are NaN."""
+  rng = np.random.default_rng(seed)
+  documents_num = len(counts)
+  if documents_num == 0:
+    names, _ = get_f1s(get_scores(metrics, counts.sum(axis=0), beta, only_split_antecedent))
+    return [(name, (float('nan'), float('nan'))) for name in names]
+  document_counts = counts.reshape(documents_num, -1)
+  all_f1s = []
+  for start in range(0, resamples, batch_size):
+    weights = get_resample_weights(rng, min(batch_size, resamples - start), documents_num)
+    sums = (weights @ document_counts).reshape(len(weights), *counts.shape[1:])
+    names, f1s = get_f1s(get_scores(metrics, sums, beta, only_split_antecedent))
+    all_f1s.append(f1s)
+  alpha = (1 - confidence) / 2
+  lower, upper = np.quantile(np.concatenate(all_f1s), [alpha, 1 - alpha], axis=0)
+  return [(name, (float(l), float(u))) for name, l, u in zip(names, lower, upper)]
+
+
+def randomization_test(metrics, counts_a, counts_b, permutations=10000, beta=1,
+    only_split_antecedent=False, seed=0, batch_size=1000):
+  """Paired approximate randomization test of the F1 scores of two systems
+  on the same documents, counts_a and counts_b are their get_count_array
+  with the documents in the same order. Each permutation swaps the counts
+  of the two systems for a random half of the documents. Returns
+  [(name, p_value)] including the CoNLL score, the p-values are NaN without
+  any document."""
+  rng = np.random.default_rng(seed)
+  documents_num = len(counts_a)
+  sums_a, sums_b = counts_a.sum(axis=0), counts_b.sum(axis=0)
+  names, f1s_a = get_f1s(get_scores(metrics, sums_a, beta, only_split_antecedent))
+  _, f1s_b = get_f1s(get_scores(metrics, sums_b, beta, only_split_antecedent))
+  if documents_num == 0:
+    return [(name, float('nan')) for name in names]
+  differences = np.abs(f1s_a - f1s_b)
+  # swapping a document moves its difference of the counts from one system
+  # to the other
+  document_differences = (counts_b - counts_a).reshape(documents_num, -1)
+  at_least_as_different = np.zeros(len(names))
+  for start in range(0, permutations, batch_size):
+    swaps = rng.integers(0, 2, (min(batch_size, permutations - start), documents_num)).astype(float)
+    moved = (swaps @ document_differences).reshape(len(swaps), *counts_a.shape[1:])
+    _, permuted_a = get_f1s(get_scores(metrics, sums_a + moved, beta, only_split_antecedent))
+    _, permuted_b = get_f1s(get_scores(metrics, sums_b - moved, beta, only_split_antecedent))
+    # the tolerance keeps the rounding errors of the sums from hiding ties
+    at_least_as_different += (np.abs(permuted_a - permuted_b) >= differences - 1e-12).sum(axis=0)
+  p_values = (at_least_as_different + 1) / (permutations + 1)
+  return [(name, float(p)) for name, p in zip(names, p_values)]
@@ -0,0 +1,147 @@
+"""Stage timers and counters to find where a run spends its time.
+
+The reader and the evaluator report their stages (e.g. reading the
+documents, the markables, the split-antecedent alignment and each metric)
+and counters (e.g. markables, clusters, the mention lookups of each metric
+and assignment problem sizes) here
+once profiling is enabled:
+
+  from coval import profiling
+  profiling.enable()
+  ...  # read and score the documents
+  print(profiling.format_report(profiling.get_report()))
+
+When it is disabled, which is the default, each stage and counter only costs
+a check of the enabled flag.
+"""
+import time
+from contextlib import contextmanager
+
+enabled = False
+stages = {}  # name: [calls, wall time, cpu time]
+counters = {}  # name: count
+document_times = []  # (wall time, doc) in seconds
+
+
+def enable():
+  """Starts a new profile."""
+  global enabled
+  reset()
+  enabled = True
+
+
+def disable():
+  global enabled
+  enabled = False
+
+
+def reset():
+  stages.clear()
+  counters.clear()
+  del document_times[:]
+
+
+@contextmanager
+def stage(name):
+  if not enabled:
+    yield
+    return
+  wall, cpu = time.perf_counter(), time.process_time()
+  try:
+    yield
+  finally:
+    add_stage(name, 1, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def add_stage(name, calls, wall, cpu):
+  if name not in stages:
+    stages[name] = [0, 0.0, 0.0]
+  stage_times = stages[name]
+  stage_times[0] += calls
+  stage_times[1] += wall
+  stage_times[2] += cpu
+
+
+def count(name, n=1):
+  if enabled:
+    counters[name] = counters.get(name, 0) + n
+
+
+def iter_stage(name, items):
+  """Adds the time spent on producing each of the items to the stage, e.g.
+  for the documents of a reader that reads them one at a time."""
+  if not enabled:
+    return items
+  return _iter_stage(name, iter(items))
+
+
+def _iter_stage(name, items):
+  while True:
+    wall, cpu = time.perf_counter(), time.process_time()
+    item = next(items, stage)
+    # the end of the items is not a call of its own
+    add_stage(name, 0 if item is stage else 1, time.perf_counter() - wall, time.process_time() - cpu)
+    if item is stage:
+      return
+    yield item
+
+
+def iter_documents(items):
+  """Yields the (doc, ...) items and records the time until the next item is
+  requested as the time of doc. This includes the reading of the document
+  and, if the documents are scored while they are read, also its scoring."""
+  if not enabled:
+    yield from items
+    return
+  items = iter(items)
+  while True:
+    start = time.perf_counter()
+    item = next(items, stage)
+    if item is stage:
+      return
+    yield item
+    document_times.append((time.perf_counter() - start, item[0]))
+
+
+def get_state():
+  """The profile so far, to be merged into the profile of another process
+  with merge_state."""
+  return dict(stages), dict(counters), list(document_times)
+
+
+def merge_state(state):
+  other_stages, other_counters, other_document_times = state
+  for name, (calls, wall, cpu) in other_stages.items():
+    add_stage(name, calls, wall, cpu)
+  for name, n in other_counters.items():
+    counters[name] = counters.get(name, 0) + n
+  document_times.extend(other_document_times)
+
+
+def get_report(slowest=10):
+  """Returns the profile as a dict that can be dumped as JSON: the stages
+  sorted by their wall time, the counters and the slowest documents."""
+  return {
+      'stages': [{'stage': name, 'calls': calls, 'wall': wall, 'cpu': cpu}
+          for name, (calls, wall, cpu) in sorted(stages.items(), key=lambda s: -s[1][1])],
+      'counters': dict(sorted(counters.items())),
+      'slowest_documents': [{'document': doc, 'wall': wall}
+          for wall, doc in sorted(document_times, key=lambda d: -d[0])[:slowest]]}
+
+
+def format_report(report):
+  """The report of get_report as a table."""
+  width = max([len(s['stage']) for s in report['stages']] + [len(name) for name in report['counters']]
+      + [len(d['document']) for d in report['slowest_documents']] + [20])
+  lines = ['%s %10s %10s %10s' % ('stage'.ljust(width), 'calls', 'wall (s)', 'cpu (s)')]
+  for s in report['stages']:
+    lines.append('%s %10d %10.3f %10.3f' % (s['stage'].ljust(width), s['calls'], s['wall'], s['cpu']))
+  lines.append('')
+  lines.append('%s %10s' % ('counter'.ljust(width), 'count'))
+  for name, n in report['counters'].items():
+    lines.append('%s %10d' % (name.ljust(width), n))
+  lines.append('')
+  lines.append('%s %10s' % ('slowest documents'.ljust(width), 'wall (s)'))
+  for d in report['slowest_documents']:
+    lines.append('%s %10.3f' % (d['document'].ljust(width), d['wall']))
+  return '\n'.join(lines)
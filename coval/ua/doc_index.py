@@ -0,0 +1,94 @@
+"""Byte ranges of the documents of a UA file, saved next to it as a .idx sidecar."""
+import json
+import mmap
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+NEWDOC_PATTERN = re.compile(rb'^[^\S\n]*# newdoc[^\n]*', re.MULTILINE)
+# a line that is neither empty nor a comment, see coval.ua.reader.read_docs
+TOKEN_LINE_PATTERN = re.compile(rb'^[^\S\n]*[^\s#]', re.MULTILINE)
+
+
+def get_index_path(path):
+  return path + INDEX_SUFFIX
+
+
+def is_index_file(path):
+  """Whether the file is a sidecar or a sidecar that is being written."""
+  return path.endswith(INDEX_SUFFIX) or path.endswith(INDEX_SUFFIX + '.tmp')
+
+
+def get_doc_index(path, save=True):
+  """Returns {doc: (start, end)} of the sidecar of the file, or builds it."""
+  doc_index = load_doc_index(path)
+  if doc_index is None:
+    doc_index = build_doc_index(path)
+    if save:
+      save_doc_index(path, doc_index)
+  return doc_index
+
+
+def build_doc_index(path):
+  """The index of the documents that coval.ua.reader.read_docs yields."""
+  with open_data(path) as data:
+    starts = [(match.start(), match.group().decode('utf-8').strip()[len('# newdoc id = '):])
+        for match in NEWDOC_PATTERN.finditer(data)]
+    doc_index = {}
+    for i, (start, doc) in enumerate(starts):
+      end = starts[i + 1][0] if i + 1 < len(starts) else len(data)
+      if TOKEN_LINE_PATTERN.search(data, start, end):
+        doc_index[doc] = (start, end)
+  return doc_index
+
+
+@contextmanager
+def open_data(path):
+  """A read-only memory map of the file."""
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      # an empty file cannot be mapped
+      yield b''
+      return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      yield data
+
+
+def get_file_stamp(path):
+  stat = os.stat(path)
+  return stat.st_size, stat.st_mtime_ns
+
+
+def load_doc_index(path):
+  """Returns the index of the sidecar of the file, or None if it is missing or stale."""
+  index_path = get_index_path(path)
+  if not os.path.exists(index_path):
+    return None
+  try:
+    with open(index_path) as f:
+      saved = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if saved.get('version') != INDEX_VERSION or tuple(saved.get('stamp', ())) != get_file_stamp(path):
+    return None
+  return {doc: (start, end) for doc, start, end in saved['documents']}
+
+
+def save_doc_index(path, doc_index):
+  """Writes the sidecar, if the directory of the file can be written."""
+  directory = os.path.dirname(os.path.abspath(path))
+  try:
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=INDEX_SUFFIX + '.tmp')
+  except OSError:
+    return
+  try:
+    with os.fdopen(fd, 'w') as f:
+      json.dump({'version': INDEX_VERSION, 'stamp': get_file_stamp(path),
+          'documents': [[doc, start, end] for doc, (start, end) in doc_index.items()]}, f)
+    os.replace(tmp_path, get_index_path(path))
+  except OSError:
+    os.remove(tmp_path)
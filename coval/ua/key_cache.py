@@ -0,0 +1,45 @@
+"""On-disk cache of the processed key documents, keyed by the key files and the reader options."""
+import hashlib
+import os
+import pickle
+import tempfile
+
+# bump when the structure of the processed key documents changes
+CACHE_VERSION = 2
+
+
+def get_cache_path(cache_dir, key_files, key_options):
+  digest = hashlib.sha256()
+  for key_file in key_files:
+    with open(key_file, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        digest.update(block)
+    # the files of a corpus are separated, so moving a document from one
+    # file to the next changes the digest
+    digest.update(b'\0')
+  digest.update(repr((CACHE_VERSION, tuple(key_options))).encode('utf-8'))
+  return os.path.join(cache_dir, 'key-%s.pickle' % digest.hexdigest())
+
+
+def load_key_docs(cache_dir, key_files, key_options):
+  """Returns the cached {doc: key_doc} of the key files, or None."""
+  path = get_cache_path(cache_dir, key_files, key_options)
+  if not os.path.exists(path):
+    return None
+  try:
+    with open(path, 'rb') as f:
+      return pickle.load(f)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    # e.g. a file truncated by an interrupted run, it is rebuilt
+    return None
+
+
+def save_key_docs(cache_dir, key_files, key_options, key_docs):
+  os.makedirs(cache_dir, exist_ok=True)
+  path = get_cache_path(cache_dir, key_files, key_options)
+  # written to a temporary file first so that concurrent runs never read a
+  # partial entry
+  fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+  with os.fdopen(fd, 'wb') as f:
+    pickle.dump(key_docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp_path, path)
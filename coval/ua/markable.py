@@ -1,35 +1,61 @@
+import sys
+
 def get_dummy_split_antecedent():
   return Markable('', 0, 0, None,'referring','')
 
+class SplitAntecedentMembers(set):
+  # the alignment of split-antecedents sums scores in the iteration order of
+  # their members, which depends on the order the members were added in. An
+  # unpickled set (e.g. of the key cache) is rebuilt in its iteration order
+  # instead, so the members are pickled in the order they were added
+  __slots__ = ('order',)
+
+  def __init__(self, members=()):
+    members = tuple(members)
+    set.__init__(self, members)
+    self.order = members
+
+  def __reduce__(self):
+    return self.__class__, (self.order,)
+
 class Markable:
-  def __init__(self, doc_name, start, end, MIN, is_referring, words,is_split_antecedent=False,split_antecedent_members=set()):
-    self.doc_name = doc_name
+  # markables are looked up in dicts by every metric, so they have no
+  # __dict__ and their hash is computed once
+  __slots__ = ('doc_name', 'start', 'end', 'MIN', 'is_referring', '_words', '_words_shared',
+      'is_split_antecedent', 'split_antecedent_members', '_hash')
+
+  def __init__(self, doc_name, start, end, MIN, is_referring, words,is_split_antecedent=False,split_antecedent_members=set(),
+      doc_words=None):
+    self.doc_name = sys.intern(doc_name)
     self.start = start
     self.end = end
     self.MIN = MIN
     self.is_referring = is_referring
-    self.words = words
+    # with doc_words the markables of a document share its word list instead
+    # of keeping a copy of their own words
+    self._words = words if doc_words is None else doc_words
+    self._words_shared = doc_words is not None
     self.is_split_antecedent = is_split_antecedent
     self.split_antecedent_members = split_antecedent_members
+    if is_split_antecedent:
+      self._hash = hash(frozenset(split_antecedent_members))
+    else:
+      self._hash = hash(frozenset((start, end)))
+
+  @property
+  def words(self):
+    if self._words_shared:
+      return self._words[self.start:self.end + 1]
+    return self._words
 
   def __eq__(self, other):
     if isinstance(other, self.__class__):
       # for split-antecedent we check all the members are the same
       if self.is_split_antecedent or other.is_split_antecedent:
         return self.split_antecedent_members == other.split_antecedent_members
-      # MIN is only set for the key markables
-      elif self.MIN:
-        return (self.doc_name == other.doc_name
-            and other.start >= self.start
-            and other.start <= self.MIN[0]
-            and other.end <= self.end
-            and other.end >= self.MIN[1])
-      elif other.MIN:
-        return (self.doc_name == other.doc_name
-            and self.start >= other.start
-            and self.start <= other.MIN[0]
-            and self.end <= other.end
-            and self.end >= other.MIN[1])
+      # the minimum span matching is resolved by the reader
+      # (coval.ua.reader.resolve_MIN_markables), so markables are only equal
+      # if their spans are
       else:
         return (self.doc_name == other.doc_name
             and self.start == other.start
@@ -42,9 +68,7 @@ class Markable:
 #     return NotImplemented
 
   def __hash__(self):
-    if self.is_split_antecedent:
-      return hash(frozenset(self.split_antecedent_members))
-    return hash(frozenset((self.start, self.end)))
+    return self._hash
 
   def __short_str__(self):
     return ('({},{})'.format(self.start,self.end))
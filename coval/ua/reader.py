@@ -1,26 +1,59 @@
+import glob
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from os import walk
-from os.path import isfile, join
+from os.path import isdir, isfile, join
 from coval.ua import markable
+from coval.ua import key_cache
+from coval.ua import doc_index
+from coval import profiling
+from coval import compression
 from collections import deque
+from itertools import chain
+from bisect import bisect_left, bisect_right
 
 __author__ = 'ns-moosavi; juntaoy'
 
+# the keep_singletons, keep_split_antecedent and keep_non_referring options of
+# the discourse deixis, as with evaluate_discourse_deixis in
+# coval.ua.scorer.get_config
+DISCOURSE_DEIXIS_OPTIONS = (True, True, False)
+
+# the features of the markable and bridging annotations that are used
+UA_FEATURES = re.compile(r'(?:^|\|)(MarkableID|EntityID|Min|ElementOf|MentionAnchor)=([^|]*)')
+
+
 def get_doc_markables(doc_name, doc_lines, extract_MIN, keep_bridging, word_column=1,
     markable_column=10, bridging_column=11, print_debug=False):
-  markables_cluster = {}
-  markables_start = {}
-  markables_end = {}
-  markables_MIN = {}
-  markables_coref_tag = {}
-  markables_split = {} # set_id: [markable_id_1, markable_id_2 ...]
+  return get_doc_layers(doc_name, doc_lines, extract_MIN, keep_bridging, word_column,
+      (markable_column,), bridging_column)[0]
+
+
+def get_doc_layers(doc_name, doc_lines, extract_MIN, keep_bridging, word_column=1,
+    markable_columns=(10, 12), bridging_column=11):
+  """The get_doc_markables of every markable column from one pass over the lines."""
+  # every layer has its markables_cluster, markables_start, markables_end,
+  # markables_MIN, markables_coref_tag, markables_split (set_id:
+  # [markable_id_1, markable_id_2 ...]) and the stack of its open markables
+  layers = [(markable_column, ({}, {}, {}, {}, {}, {}, [])) for markable_column in markable_columns]
   bridging_antecedents = {}
   all_words = []
-  stack = []
+  # the lines are only split up to the last column that is used, and the
+  # lines without any bracket, which have no annotations, up to the word
+  last_column = max(word_column, *markable_columns, bridging_column if keep_bridging else 0)
   for word_index, line in enumerate(doc_lines):
-    columns = line.split()
+    if '(' not in line and ')' not in line:
+      all_words.append(line.split(None, word_column + 1)[word_column])
+      continue
+    columns = line.split(None, last_column + 1)
     all_words.append(columns[word_column])
 
-    if columns[markable_column] != '_':
+    for markable_column, layer in layers:
+      if columns[markable_column] == '_':
+        continue
+      (markables_cluster, markables_start, markables_end, markables_MIN, markables_coref_tag,
+          markables_split, stack) = layer
       markable_annotations = columns[markable_column].split("(")
       if markable_annotations[0]:
         #the close bracket
@@ -34,7 +67,7 @@ def get_doc_markables(doc_name, doc_lines, extract_MIN, keep_bridging, word_colu
           markable_annotation = markable_annotation[:-1]
         else:
           single_word = False
-        markable_info = {p[:p.find('=')]:p[p.find('=')+1:] for p in markable_annotation.split('|')}
+        markable_info = dict(UA_FEATURES.findall(markable_annotation))
         markable_id = markable_info['MarkableID']
         cluster_id = markable_info['EntityID']
         markables_cluster[markable_id] = cluster_id
@@ -55,9 +88,7 @@ def get_doc_markables(doc_name, doc_lines, extract_MIN, keep_bridging, word_colu
             MIN_end = MIN_start
           markables_MIN[markable_id] = (MIN_start,MIN_end)
 
-        markables_coref_tag[markable_id] = 'referring'
-        if cluster_id.endswith('-Pseudo'):
-          markables_coref_tag[markable_id] = 'non_referring'
+        markables_coref_tag[markable_id] = 'non_referring' if cluster_id.endswith('-Pseudo') else 'referring'
 
         if 'ElementOf' in markable_info:
           element_of = markable_info['ElementOf'].split(',') # for markable participate in multiple plural using , split the element_of, e.g. ElementOf=1,2
@@ -70,66 +101,72 @@ def get_doc_markables(doc_name, doc_lines, extract_MIN, keep_bridging, word_colu
       for bridging_annotation in bridging_annotations[1:]:
         if bridging_annotation.endswith(')'):
           bridging_annotation = bridging_annotation[:-1]
-        bridging_info = {p[:p.find('=')]:p[p.find('=')+1:] for p in bridging_annotation.split('|')}
+        bridging_info = dict(UA_FEATURES.findall(bridging_annotation))
         bridging_antecedents[bridging_info['MarkableID']] = bridging_info['MentionAnchor']
 
+  doc_layers = []
+  for _, layer in layers:
+    clusters, id2markable = get_layer_clusters(doc_name, layer, all_words)
+    bridging_pairs = {}
+    if not doc_layers:
+      for anaphora, antecedent in bridging_antecedents.items():
+        if not anaphora in id2markable or not antecedent in id2markable:
+          print('Skip bridging pair ({}, {}) as markable_id does not exist in identity column!'.format(antecedent,anaphora))
+          continue
+        bridging_pairs[id2markable[anaphora]] = id2markable[antecedent]
+    doc_layers.append((clusters, bridging_pairs))
 
+  #print([(str(ana),str(ant)) for ana,ant in bridging_pairs.items()])
+  # for cid in clusters:
+  #   cl = clusters[cid]
+  #   print(cid,[str(m) for m in cl[0]],cl[1],cl[2],cl[3] )
+  return doc_layers
 
 
+def get_layer_clusters(doc_name, layer, all_words):
+  """The clusters of a layer of get_doc_layers and its markables by id."""
+  (markables_cluster, markables_start, markables_end, markables_MIN, markables_coref_tag,
+      markables_split, _) = layer
   clusters = {}
   id2markable = {}
-  for markable_id in markables_cluster:
+  for markable_id, cluster_id in markables_cluster.items():
+    coref_tag = markables_coref_tag[markable_id]
     m = markable.Markable(
         doc_name, markables_start[markable_id],
         markables_end[markable_id], markables_MIN[markable_id],
-        markables_coref_tag[markable_id],
-        all_words[markables_start[markable_id]:
-            markables_end[markable_id] + 1])
+        coref_tag,
+        None, doc_words=all_words)
     id2markable[markable_id] = m
-    if markables_cluster[markable_id] not in clusters:
-      clusters[markables_cluster[markable_id]] = (
-          [], markables_coref_tag[markable_id],doc_name,[markables_cluster[mid] for mid in markables_split.get(markables_cluster[markable_id],[])])
-    clusters[markables_cluster[markable_id]][0].append(m)
-
-  bridging_pairs = {}
-  for anaphora, antecedent in bridging_antecedents.items():
-    if not anaphora in id2markable or not antecedent in id2markable:
-      print('Skip bridging pair ({}, {}) as markable_id does not exist in identity column!'.format(antecedent,anaphora))
-      continue
-    bridging_pairs[id2markable[anaphora]] = id2markable[antecedent]
-
-  #print([(str(ana),str(ant)) for ana,ant in bridging_pairs.items()])
-  # for cid in clusters:
-  #   cl = clusters[cid]
-  #   print(cid,[str(m) for m in cl[0]],cl[1],cl[2],cl[3] )
-  return clusters, bridging_pairs
-
-
-def process_clusters(clusters, keep_singletons, keep_non_referring,keep_split_antecedent):
+    cluster = clusters.get(cluster_id)
+    if cluster is None:
+      cluster = clusters[cluster_id] = (
+          [], coref_tag,doc_name,[markables_cluster[mid] for mid in markables_split.get(cluster_id,[])])
+    cluster[0].append(m)
+  return clusters, id2markable
+
+
+def process_clusters(clusters, keep_singletons, keep_non_referring,keep_split_antecedent,
+    split_antecedent_members=None):
+  """Processes the clusters of get_doc_markables for a setting without changing them."""
+  # split_antecedent_members caches the members of each plural cluster id, so
+  # that the settings of the same clusters share them
+  if split_antecedent_members is None:
+    split_antecedent_members = {}
   removed_non_referring = 0
   removed_singletons = 0
   processed_clusters = []
   processed_non_referrings = []
 
+  member_clusters = {}
   for cluster_id, (cluster, ref_tag, doc_name, split_cid_list) in clusters.items():
     #recusively find the split singular cluster
     if split_cid_list and keep_split_antecedent:
       # if using split-antecedent, we shouldn't remove singletons as they might be used by split-antecedents
       assert keep_singletons
-      split_clusters = set()
-      queue = deque()
-      queue.append(cluster_id)
-      while queue:
-        curr = queue.popleft()
-        curr_cl, curr_ref_tag, doc_name, curr_cid_list = clusters[curr]
-        #non_referring shouldn't be used as split-antecedents
-        # if curr_ref_tag != 'referring':
-        #   print(curr_ref_tag, doc_name, curr_cid_list)
-        if curr_cid_list:
-          for c in curr_cid_list:
-            queue.append(c)
-        else:
-          split_clusters.add(tuple(curr_cl))
+      if cluster_id not in split_antecedent_members:
+        split_antecedent_members[cluster_id] = get_split_antecedent_members(
+            clusters, cluster_id, member_clusters)
+      split_clusters = split_antecedent_members[cluster_id]
       split_m = markable.Markable(
         doc_name, -1,
         -1, None,
@@ -138,7 +175,7 @@ def process_clusters(clusters, keep_singletons, keep_non_referring,keep_split_an
         is_split_antecedent=True,
         split_antecedent_members=split_clusters)
 
-      cluster.append(split_m) #add the split_antecedents
+      cluster = cluster + [split_m] #add the split_antecedents
 
     if ref_tag == 'non_referring':
       if keep_non_referring:
@@ -155,21 +192,25 @@ def process_clusters(clusters, keep_singletons, keep_non_referring,keep_split_an
 
   if keep_split_antecedent:
     #step 2 merge equivalent split-antecedents clusters
+    # the merged clusters are indexed by their split-antecedents, whose hash
+    # and equality are those of their member sets
     merged_clusters = []
+    merged_ids = {}
     for cl in processed_clusters:
       existing = None
       for m in cl:
-        if m.is_split_antecedent:
+        if m.is_split_antecedent and m in merged_ids:
         #only do this for split-antecedents
-          for c2 in merged_clusters:
-            if m in c2:
-              existing = c2
-              break
-      if existing:
+          existing = merged_ids[m]
+      if existing is not None:
         # print('merge cluster ', [str(m) for m in cl], ' and ', [str(m) for m in existing])
-        existing.update(cl)
+        merged_clusters[existing].update(cl)
       else:
+        existing = len(merged_clusters)
         merged_clusters.append(set(cl))
+      for m in cl:
+        if m.is_split_antecedent:
+          merged_ids.setdefault(m, existing)
     merged_clusters = [list(cl) for cl in merged_clusters]
   else:
     merged_clusters = processed_clusters
@@ -178,6 +219,31 @@ def process_clusters(clusters, keep_singletons, keep_non_referring,keep_split_an
       removed_non_referring, removed_singletons)
 
 
+def get_split_antecedent_members(clusters, cluster_id, member_clusters):
+  """The member clusters of a plural cluster, found breadth first."""
+  # member_clusters memoizes the members of each cluster id of the document
+  split_clusters = []
+  visited = {cluster_id}
+  queue = deque()
+  queue.append(cluster_id)
+  while queue:
+    curr = queue.popleft()
+    curr_cl, curr_ref_tag, doc_name, curr_cid_list = clusters[curr]
+    #non_referring shouldn't be used as split-antecedents
+    # if curr_ref_tag != 'referring':
+    #   print(curr_ref_tag, doc_name, curr_cid_list)
+    if curr_cid_list:
+      for c in curr_cid_list:
+        if c not in visited:
+          visited.add(c)
+          queue.append(c)
+    else:
+      if curr not in member_clusters:
+        member_clusters[curr] = tuple(curr_cl)
+      split_clusters.append(member_clusters[curr])
+  return markable.SplitAntecedentMembers(split_clusters)
+
+
 def get_coref_infos(key_file,
     sys_file,
     keep_singletons,
@@ -186,51 +252,381 @@ def get_coref_infos(key_file,
     keep_non_referring,
     evaluate_discourse_deixis,
     use_MIN,
-    print_debug=False):
-  key_docs = get_all_docs(key_file)
-  sys_docs = get_all_docs(sys_file)
-
+    print_debug=False,
+    key_cache_dir=None,
+    workers=1):
   doc_coref_infos = {}
   doc_non_referrig_infos = {}
   doc_bridging_infos = {}
 
-  for doc in key_docs:
+  for doc, coref_info, non_referring_info, bridging_info in iter_coref_infos(key_file, sys_file,
+      keep_singletons, keep_split_antecedent, keep_bridging, keep_non_referring,
+      evaluate_discourse_deixis, use_MIN, print_debug=print_debug, stream=False, key_cache_dir=key_cache_dir,
+      workers=workers):
+    doc_coref_infos[doc] = coref_info
+    doc_non_referrig_infos[doc] = non_referring_info
+    doc_bridging_infos[doc] = bridging_info
+
+  return doc_coref_infos, doc_non_referrig_infos, doc_bridging_infos
+
+
+def iter_coref_infos(key_file,
+    sys_file,
+    keep_singletons,
+    keep_split_antecedent,
+    keep_bridging,
+    keep_non_referring,
+    evaluate_discourse_deixis,
+    use_MIN,
+    print_debug=False,
+    stream=True,
+    key_cache_dir=None,
+    key_docs=None,
+    docs=None,
+    workers=1):
+  """Yields (doc, coref_info, non_referring_info, bridging_info), see iter_doc_layers."""
+  key_options = (keep_singletons, keep_split_antecedent, keep_bridging, keep_non_referring,
+      evaluate_discourse_deixis, use_MIN, False)
+  for doc, key_doc, sys_layers in iter_doc_layers(key_file, sys_file, key_options, stream,
+      key_cache_dir, key_docs, docs, workers):
+    sys_clusters, sys_bridging_pairs = sys_layers[0]
+    yield (doc,) + get_coref_info(key_doc, sys_clusters, sys_bridging_pairs, keep_singletons,
+        keep_split_antecedent, keep_non_referring, use_MIN, print_debug)
+
+
+def iter_all_layer_coref_infos(key_file,
+    sys_file,
+    keep_singletons,
+    keep_split_antecedent,
+    keep_non_referring,
+    use_MIN,
+    print_debug=False,
+    stream=True,
+    key_cache_dir=None,
+    key_docs=None,
+    docs=None,
+    workers=1):
+  """The iter_coref_infos of the identity layer with the coref_info of the discourse deixis."""
+  key_options = (keep_singletons, keep_split_antecedent, True, keep_non_referring, False, use_MIN, True)
+  for doc, (key_doc, discourse_deixis_key_doc), sys_layers in iter_doc_layers(key_file, sys_file,
+      key_options, stream, key_cache_dir, key_docs, docs, workers):
+    (sys_clusters, sys_bridging_pairs), (discourse_deixis_clusters, _) = sys_layers
+    yield ((doc,) + get_coref_info(key_doc, sys_clusters, sys_bridging_pairs, keep_singletons,
+        keep_split_antecedent, keep_non_referring, use_MIN, print_debug)
+        + get_coref_info(discourse_deixis_key_doc, discourse_deixis_clusters, {},
+            *DISCOURSE_DEIXIS_OPTIONS, use_MIN, print_debug)[:1])
+
+
+def iter_setting_coref_infos(key_file,
+    sys_file,
+    keep_bridging,
+    evaluate_discourse_deixis,
+    settings,
+    print_debug=False,
+    stream=True,
+    key_cache_dir=None,
+    docs=None,
+    workers=1):
+  """Yields (doc, [(coref_info, non_referring_info, bridging_info)]) of every setting."""
+  # the options of the settings replace those of a single setting
+  key_options = (None, None, keep_bridging, None, evaluate_discourse_deixis, None, False, settings)
+  for doc, key_docs, sys_layers in iter_doc_layers(key_file, sys_file, key_options, stream,
+      key_cache_dir, docs=docs, workers=workers):
+    sys_clusters, sys_bridging_pairs = sys_layers[0]
+    split_antecedent_members = {}
+    yield doc, [get_coref_info(key_doc, sys_clusters, sys_bridging_pairs, *setting, print_debug,
+        split_antecedent_members=split_antecedent_members)
+        for key_doc, setting in zip(key_docs, settings)]
+
+
+def iter_doc_layers(key_file, sys_file, key_options, stream=True, key_cache_dir=None,
+    key_docs=None, docs=None, workers=1):
+  """Yields (doc, key_doc, sys_layers) of the key and system files or corpora."""
+  keep_bridging = key_options[2]
+  markable_columns = get_markable_columns(key_options[4], key_options[6])
+  if docs is not None:
+    docs = set(docs)
+  if key_docs is None and (key_cache_dir or not isfile(key_file)):
+    key_docs = get_key_docs(key_file, key_options, key_cache_dir, docs, workers)
+  if key_docs is not None:
+    key_docs = key_docs.items() if docs is None else [(doc, key_doc)
+        for doc, key_doc in key_docs.items() if doc in docs]
+  else:
+    key_docs = ((doc, get_key_doc(doc, key_doc_lines, *key_options))
+        for doc, key_doc_lines in (iter_docs(key_file, docs) if stream or docs is not None
+            else get_all_docs(key_file).items()))
+
+  # the documents of a system corpus are read and their markables parsed
+  # by the workers
+  sys_corpus = not isfile(sys_file)
+  if sys_corpus:
+    with profiling.stage('read corpus'):
+      sys_docs = get_corpus_docs(sys_file, partial(read_sys_file, keep_bridging=keep_bridging,
+          markable_columns=markable_columns, docs=docs), workers)
+    doc_pairs = ((doc, key_doc, sys_docs.get(doc)) for doc, key_doc in key_docs)
+  elif docs is not None:
+    doc_pairs = pair_indexed_sys_docs(key_docs, sys_file, docs)
+  else:
+    doc_pairs = stream_sys_docs(key_docs, sys_file) if stream else pair_sys_docs(key_docs, sys_file)
+  for doc, key_doc, sys_doc in profiling.iter_documents(doc_pairs):
 
-    if doc not in sys_docs:
+    if sys_doc is None:
       print('The document ', doc,
           ' does not exist in the system output.')
       continue
-    markable_column = 12 if evaluate_discourse_deixis else 10
-    key_clusters, key_bridging_pairs = get_doc_markables(doc, key_docs[doc], use_MIN, keep_bridging,markable_column=markable_column)
-    sys_clusters, sys_bridging_pairs = get_doc_markables(doc, sys_docs[doc], False, keep_bridging,markable_column=markable_column)
 
-    (key_clusters, key_non_referrings, key_removed_non_referring,
-        key_removed_singletons) = process_clusters(
-        key_clusters, keep_singletons, keep_non_referring,keep_split_antecedent)
+    if sys_corpus:
+      sys_layers = sys_doc
+    else:
+      with profiling.stage('read markables'):
+        sys_layers = get_doc_layers(doc, sys_doc, False, keep_bridging, markable_columns=markable_columns)
+    yield doc, key_doc, sys_layers
+
+
+def iter_span_coref_infos(key_docs, span_docs, keep_singletons, keep_split_antecedent,
+    keep_non_referring, use_MIN, docs=None, print_debug=False):
+  """The iter_coref_infos of the system documents of get_span_docs."""
+  if docs is not None:
+    docs = set(docs)
+  doc_pairs = ((doc, key_doc) for doc, key_doc in key_docs.items() if docs is None or doc in docs)
+  for doc, key_doc in profiling.iter_documents(doc_pairs):
+    sys_clusters, sys_bridging_pairs = span_docs.get(doc, ({}, {}))
+    yield (doc,) + get_coref_info(key_doc, sys_clusters, sys_bridging_pairs, keep_singletons,
+        keep_split_antecedent, keep_non_referring, use_MIN, print_debug)
+
+
+def get_coref_info(key_doc, sys_clusters, sys_bridging_pairs, keep_singletons,
+    keep_split_antecedent, keep_non_referring, use_MIN, print_debug=False,
+    split_antecedent_members=None):
+  """Pairs the markables of a system document with its processed key document."""
+  (key_markables, key_clusters, key_non_referrings, key_bridging_pairs,
+      key_removed_non_referring, key_removed_singletons) = key_doc
+
+  if use_MIN:
+    with profiling.stage('resolve MIN markables'):
+      sys_clusters, sys_bridging_pairs = resolve_MIN_markables(key_markables, sys_clusters, sys_bridging_pairs)
+    # the resolved clusters have members of their own
+    split_antecedent_members = None
+
+  with profiling.stage('process clusters'):
     (sys_clusters, sys_non_referrings, sys_removed_non_referring,
         sys_removed_singletons) = process_clusters(
-        sys_clusters, keep_singletons, keep_non_referring,keep_split_antecedent)
-
-    sys_mention_key_cluster = get_markable_assignments(key_clusters)
-    key_mention_sys_cluster = get_markable_assignments(sys_clusters)
-
-    doc_coref_infos[doc] = (key_clusters, sys_clusters,
-          key_mention_sys_cluster, sys_mention_key_cluster)
-    doc_non_referrig_infos[doc] = (key_non_referrings, sys_non_referrings)
-    doc_bridging_infos[doc] = (key_bridging_pairs, sys_bridging_pairs, sys_mention_key_cluster)
-
-    if print_debug and not keep_non_referring:
-      print('%s and %s non-referring markables are removed from the '
-          'evaluations of the key and system files, respectively.'
-          % (key_removed_non_referring, sys_removed_non_referring))
-
-    if print_debug and not keep_singletons:
-      print('%s and %s singletons are removed from the evaluations of '
-          'the key and system files, respectively.'
-          % (key_removed_singletons, sys_removed_singletons))
-
-  return doc_coref_infos, doc_non_referrig_infos, doc_bridging_infos
-
+        sys_clusters, keep_singletons, keep_non_referring,keep_split_antecedent,
+        split_antecedent_members)
+
+  sys_mention_key_cluster = get_markable_assignments(key_clusters)
+  key_mention_sys_cluster = get_markable_assignments(sys_clusters)
+
+  if profiling.enabled:
+    profiling.count('documents')
+    for side, clusters in (('key', key_clusters), ('system', sys_clusters)):
+      profiling.count(side + ' clusters', len(clusters))
+      profiling.count(side + ' markables', sum(len(cl) for cl in clusters))
+
+  if print_debug and not keep_non_referring:
+    print('%s and %s non-referring markables are removed from the '
+        'evaluations of the key and system files, respectively.'
+        % (key_removed_non_referring, sys_removed_non_referring))
+
+  if print_debug and not keep_singletons:
+    print('%s and %s singletons are removed from the evaluations of '
+        'the key and system files, respectively.'
+        % (key_removed_singletons, sys_removed_singletons))
+
+  return ((key_clusters, sys_clusters, key_mention_sys_cluster, sys_mention_key_cluster),
+      (key_non_referrings, sys_non_referrings),
+      (key_bridging_pairs, sys_bridging_pairs, sys_mention_key_cluster))
+
+
+def get_span_docs(clusters, split_antecedents=None, bridging_pairs=None, non_referrings=None):
+  """Builds system documents from clusters of (doc, start, end) spans, with
+  0-based inclusive token indexes, as get_doc_markables builds them from lines."""
+  all_clusters = [(str(i), cluster, 'referring') for i, cluster in enumerate(clusters)]
+  all_clusters += [('%d-Pseudo' % i, [span], 'non_referring')
+      for i, span in enumerate(non_referrings or [])]
+
+  doc_clusters = {}
+  for cluster_id, cluster, ref_tag in all_clusters:
+    spans = [get_span(span) for span in cluster]
+    if not spans:
+      continue
+    doc = spans[0][0]
+    if any(span[0] != doc for span in spans):
+      raise ValueError('The spans of cluster %s are in different documents' % cluster_id)
+    # the outer markables are opened first in a file
+    spans = sorted(set((start, end) for _, start, end in spans), key=lambda s: (s[0], -s[1]))
+    doc_clusters.setdefault(doc, []).append((spans, cluster_id, ref_tag))
+
+  # the ElementOf of the member clusters, as in get_doc_markables
+  element_of = {}
+  for plural, members in (split_antecedents or {}).items():
+    element_of[str(plural)] = [str(member) for member in members]
+
+  span_markables = {}
+  span_docs = {}
+  for doc, doc_cluster_list in doc_clusters.items():
+    doc_cluster_list.sort(key=lambda c: (c[0][0][0], -c[0][0][1]))
+    positions = {cluster_id: i for i, (_, cluster_id, _) in enumerate(doc_cluster_list)}
+    doc_markables = {}
+    for spans, cluster_id, ref_tag in doc_cluster_list:
+      members = element_of.get(cluster_id, [])
+      if any(member not in positions for member in members):
+        raise ValueError('The split-antecedents of cluster %s are not clusters of document %s'
+            % (cluster_id, doc))
+      cluster = []
+      for start, end in spans:
+        m = markable.Markable(doc, start, end, None, ref_tag, [])
+        span_markables[(doc, start, end)] = m
+        cluster.append(m)
+      doc_markables[cluster_id] = (cluster, ref_tag, doc, sorted(members, key=positions.get))
+    span_docs[doc] = (doc_markables, {})
+
+  for anaphor, antecedent in bridging_pairs or []:
+    anaphor, antecedent = get_span(anaphor), get_span(antecedent)
+    if anaphor not in span_markables or antecedent not in span_markables:
+      print('Skip bridging pair ({}, {}) as the spans are not in any cluster!'.format(antecedent,anaphor))
+      continue
+    span_docs[anaphor[0]][1][span_markables[anaphor]] = span_markables[antecedent]
+  return span_docs
+
+
+def get_span(span):
+  doc, start, end = span
+  # the indexes may be NumPy integers
+  return str(doc), int(start), int(end)
+
+
+def get_key_docs(key_file, key_options, key_cache_dir=None, docs=None, workers=1):
+  """Returns {doc: key_doc} of the get_key_doc of the key file or corpus."""
+  if key_cache_dir:
+    key_files = get_corpus_files(key_file)
+    with profiling.stage('load key cache'):
+      key_docs = key_cache.load_key_docs(key_cache_dir, key_files, key_options)
+    if key_docs is None:
+      # the cache entries are of the whole key
+      key_docs = read_key_docs(key_file, key_options, workers=workers)
+      with profiling.stage('save key cache'):
+        key_cache.save_key_docs(key_cache_dir, key_files, key_options, key_docs)
+  else:
+    key_docs = read_key_docs(key_file, key_options, docs, workers)
+  if docs is not None:
+    docs = set(docs)
+    key_docs = {doc: key_doc for doc, key_doc in key_docs.items() if doc in docs}
+  return key_docs
+
+
+def read_key_docs(key_file, key_options, docs=None, workers=1):
+  if isfile(key_file):
+    return read_key_file(key_file, key_options, docs)
+  with profiling.stage('read corpus'):
+    return get_corpus_docs(key_file, partial(read_key_file, key_options=key_options, docs=docs,
+        index=False), workers)
+
+
+def read_key_file(path, key_options, docs=None, index=True):
+  return {doc: get_key_doc(doc, key_doc_lines, *key_options)
+      for doc, key_doc_lines in get_all_docs(path, docs, index).items()}
+
+
+def read_sys_file(path, keep_bridging, markable_columns, docs=None):
+  """The get_doc_layers of the documents of a file of a system corpus."""
+  return {doc: get_doc_layers(doc, sys_doc_lines, False, keep_bridging,
+      markable_columns=markable_columns)
+      for doc, sys_doc_lines in get_all_docs(path, docs, index=False).items()}
+
+
+def get_markable_columns(evaluate_discourse_deixis, all_layers):
+  if all_layers:
+    return (10, 12)
+  return (12,) if evaluate_discourse_deixis else (10,)
+
+
+def get_key_doc(doc, key_doc_lines, keep_singletons, keep_split_antecedent, keep_bridging,
+    keep_non_referring, evaluate_discourse_deixis, use_MIN, all_layers=False, settings=None):
+  """Reads and processes the markables of a key document."""
+  if settings is not None:
+    # the MIN spans are not part of the identity of the markables, so they
+    # are read for all the settings if any of them needs them
+    use_MIN = any(setting[3] for setting in settings)
+  with profiling.stage('read markables'):
+    key_layers = get_doc_layers(doc, key_doc_lines, use_MIN, keep_bridging,
+        markable_columns=get_markable_columns(evaluate_discourse_deixis, all_layers))
+  key_clusters, key_bridging_pairs = key_layers[0]
+  if settings is not None:
+    split_antecedent_members = {}
+    return [process_key_doc(key_clusters, key_bridging_pairs, *setting,
+        split_antecedent_members=split_antecedent_members) for setting in settings]
+  key_doc = process_key_doc(key_clusters, key_bridging_pairs, keep_singletons,
+      keep_split_antecedent, keep_non_referring, use_MIN)
+  if not all_layers:
+    return key_doc
+  key_clusters, key_bridging_pairs = key_layers[1]
+  return key_doc, process_key_doc(key_clusters, key_bridging_pairs, *DISCOURSE_DEIXIS_OPTIONS, use_MIN)
+
+
+def process_key_doc(key_clusters, key_bridging_pairs, keep_singletons, keep_split_antecedent,
+    keep_non_referring, use_MIN, split_antecedent_members=None):
+  """The processed key document of a layer of get_doc_layers."""
+  # all the key markables are needed to resolve the system markables in the
+  # minimum span setting
+  key_markables = [m for cl in key_clusters.values() for m in cl[0]] if use_MIN else None
+
+  with profiling.stage('process clusters'):
+    (key_clusters, key_non_referrings, key_removed_non_referring,
+        key_removed_singletons) = process_clusters(
+        key_clusters, keep_singletons, keep_non_referring,keep_split_antecedent,
+        split_antecedent_members)
+  return (key_markables, key_clusters, key_non_referrings, key_bridging_pairs,
+      key_removed_non_referring, key_removed_singletons)
+
+
+def get_MIN_matches(key_markables, sys_markables):
+  """Maps id(m) of the system markables that match a key markable in the MIN setting to it."""
+  # every key markable is matched at most once, exact matches first and
+  # otherwise the smallest key markable around the system markable
+  matches = {}
+  matched_keys = set()
+  key_spans = {}
+  for k in key_markables:
+    key_spans.setdefault((k.start, k.end), []).append(k)
+  unmatched = []
+  for m in sys_markables:
+    candidates = key_spans.get((m.start, m.end))
+    if candidates:
+      k = candidates.pop()
+      matches[id(m)] = k
+      matched_keys.add(id(k))
+    else:
+      unmatched.append(m)
+
+  # the MIN span of a matching key markable lies within the system markable,
+  # so the candidates are found by bisecting the sorted MIN starts
+  by_MIN_start = sorted(((k.MIN or (k.start, k.end))[0], k.end - k.start, k.start, i)
+      for i, k in enumerate(key_markables) if id(k) not in matched_keys)
+  MIN_starts = [entry[0] for entry in by_MIN_start]
+  for m in sorted(unmatched, key=lambda m: (m.start, m.end)):
+    best = None
+    for entry in by_MIN_start[bisect_left(MIN_starts, m.start):bisect_right(MIN_starts, m.end)]:
+      k = key_markables[entry[3]]
+      MIN_end = (k.MIN or (k.start, k.end))[1]
+      if (id(k) not in matched_keys and k.start <= m.start and m.end <= k.end and MIN_end <= m.end
+          and (best is None or entry[1:3] < best[1:3])):
+        best = entry
+    if best:
+      k = key_markables[best[3]]
+      matches[id(m)] = k
+      matched_keys.add(id(k))
+  return matches
+
+
+def resolve_MIN_markables(key_markables, sys_clusters, sys_bridging_pairs):
+  """Replaces the system markables of get_MIN_matches with their key markables."""
+  matches = get_MIN_matches(key_markables, [m for cl in sys_clusters.values() for m in cl[0]])
+  resolved_clusters = {cid: ([matches.get(id(m), m) for m in cl[0]],) + cl[1:]
+      for cid, cl in sys_clusters.items()}
+  resolved_bridging_pairs = {matches.get(id(anaphora), anaphora): matches.get(id(antecedent), antecedent)
+      for anaphora, antecedent in sys_bridging_pairs.items()}
+  return resolved_clusters, resolved_bridging_pairs
 
 
 def get_markable_assignments(clusters):
@@ -241,15 +637,101 @@ def get_markable_assignments(clusters):
   return markable_cluster_ids
 
 
-def get_all_docs(path):
+def get_all_docs(path, docs=None, index=True):
   all_docs = {}
+  for doc_name, doc_lines in iter_docs(path, docs, index):
+    all_docs[doc_name] = doc_lines
+  return all_docs
+
+
+def get_corpus_files(path):
+  """The file, the files of a directory or the files that match a glob pattern."""
+  if isfile(path):
+    return [path]
+  if isdir(path):
+    files = [join(root, name) for root, _, names in walk(path) for name in names
+        if not name.startswith('.')]
+  else:
+    files = [file for file in glob.glob(path, recursive=True) if isfile(file)]
+  files = sorted(file for file in files if not doc_index.is_index_file(file))
+  if not files:
+    raise FileNotFoundError('No files found for %s' % path)
+  return files
+
+
+def get_corpus_docs(path, read_file, workers=1):
+  """The {doc: ...} of read_file of the files of a corpus."""
+  files = get_corpus_files(path)
+  corpus_docs = {}
+  if workers > 1 and len(files) > 1:
+    with ProcessPoolExecutor(min(workers, len(files))) as executor:
+      for file_docs in executor.map(read_file, files, chunksize=max(1, len(files) // (workers * 4))):
+        corpus_docs.update(file_docs)
+  else:
+    for file in files:
+      corpus_docs.update(read_file(file))
+  return corpus_docs
+
+
+def pair_sys_docs(key_docs, sys_file):
+  """Returns (doc, key_doc, sys_doc_lines) of the key documents, reading the whole system file."""
+  sys_docs = get_all_docs(sys_file)
+  return [(doc, key_doc, sys_docs.get(doc)) for doc, key_doc in key_docs]
+
+
+def iter_docs(path, docs=None, index=True):
+  """Yields (doc_name, doc_lines) of a file or corpus, with docs only these documents."""
+  if not isfile(path):
+    for file in get_corpus_files(path):
+      yield from iter_docs(file, docs, index=False)
+    return
+  if docs is not None and index and not compression.get_compression(path):
+    yield from profiling.iter_stage('read documents', read_indexed_docs(path, docs))
+    return
+  with compression.open_file(path) as f:
+    for doc_name, doc_lines in profiling.iter_stage('read documents', read_docs(f)):
+      if docs is None or doc_name in docs:
+        yield doc_name, doc_lines
+
+
+def read_indexed_docs(path, docs):
+  """Reads the documents of docs through the offset index of the file."""
+  docs = set(docs)
+  doc_ranges = [(start, end) for doc, (start, end) in doc_index.get_doc_index(path).items() if doc in docs]
+  with doc_index.open_data(path) as data:
+    for start, end in doc_ranges:
+      yield from read_docs(data[start:end].split(b'\n'))
+
+
+def pair_indexed_sys_docs(key_docs, sys_file, docs=None, save_index=True):
+  """The pair_sys_docs of a system file read through its offset index, which
+  is saved as a sidecar with save_index."""
+  if compression.get_compression(sys_file):
+    sys_docs = get_all_docs(sys_file, docs)
+    yield from ((doc, key_doc, sys_docs.get(doc)) for doc, key_doc in key_docs)
+    return
+  with profiling.stage('index documents'):
+    sys_doc_ranges = doc_index.get_doc_index(sys_file, save=save_index)
+  with doc_index.open_data(sys_file) as sys_data:
+    for doc, key_doc in key_docs:
+      sys_doc_lines = None
+      if doc in sys_doc_ranges:
+        start, end = sys_doc_ranges[doc]
+        with profiling.stage('read documents'):
+          for _, sys_doc_lines in read_docs(sys_data[start:end].split(b'\n')):
+            pass
+      yield doc, key_doc, sys_doc_lines
+
+
+def read_docs(f):
+  """Yields (doc_name, doc_lines) of the byte lines of a file."""
   doc_lines = []
   doc_name = None
-  for line in open(path):
-    line = line.strip()
+  for line in f:
+    line = line.decode('utf-8').strip()
     if line.startswith('# newdoc'):
       if doc_name and doc_lines:
-        all_docs[doc_name] = doc_lines
+        yield doc_name, doc_lines
         doc_lines = []
       doc_name = line[len('# newdoc id = '):]
     elif line.startswith('#') or len(line) == 0:
@@ -257,11 +739,19 @@ def get_all_docs(path):
     else:
       doc_lines.append(line)
   if doc_name and doc_lines:
-    all_docs[doc_name] = doc_lines
-  return all_docs
-
-
-
-
-
-
+    yield doc_name, doc_lines
+
+
+def stream_sys_docs(key_docs, sys_file):
+  """The pair_sys_docs of a system file that is read in step with the key."""
+  key_docs = iter(key_docs)
+  with compression.open_file(sys_file) as sys_f:
+    sys_docs = profiling.iter_stage('read documents', read_docs(sys_f))
+    for doc, key_doc in key_docs:
+      sys_doc = next(sys_docs, None)
+      if not sys_doc or sys_doc[0] != doc:
+        break
+      yield doc, key_doc, sys_doc[1]
+    else:
+      return
+  yield from pair_indexed_sys_docs(chain([(doc, key_doc)], key_docs), sys_file, save_index=False)
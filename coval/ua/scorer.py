@@ -0,0 +1,294 @@
+"""Scoring of Universal Anaphora files from Python.
+
+ua-scorer.py is a thin command line wrapper of this module. To score in the
+same process, e.g. every few hundred steps of a training loop:
+
+  import coval
+  scores = coval.score(key_file, sys_file, {'metrics': ['muc', 'bcub', 'ceafe']})
+  print(scores['conll'])
+
+or, to read and process the key only once for many system outputs:
+
+  scorer = coval.Scorer(key_file, {'use_MIN': True})
+  for sys_file in sys_files:
+    print(scorer.score(sys_file)['conll'])
+
+The output of a model can also be scored without writing it to a file, as
+clusters of (doc, start, end) spans:
+
+  scores = scorer.score_spans([[('doc1', 0, 1), ('doc1', 5, 5)], [('doc2', 3, 4)]])
+
+The config is a dict with the options of the command line (see
+DEFAULT_CONFIG), the scores are the dict of get_scores. With all_layers the
+identity coreference, the bridging and the discourse deixis are scored
+together from one pass over the files:
+
+  scores = coval.score(key_file, sys_file, {'all_layers': True})
+  print(scores['conll'], scores['bridging'], scores['discourse_deixis']['conll'])
+
+To score the same system in several settings, e.g. with and without
+singletons or with exact and MIN spans, from one parse of the files:
+
+  for name, scores in coval.score_matrix(key_file, sys_file):
+    print(name, scores['conll'])
+"""
+from coval.ua import reader
+from coval.eval import evaluator
+from coval.eval import significance
+
+METRICS = {
+    'lea': evaluator.lea, 'muc': evaluator.muc,
+    'bcub': evaluator.b_cubed, 'ceafe': evaluator.ceafe,
+    'ceafm': evaluator.ceafm, 'blanc': [evaluator.blancc, evaluator.blancn]}
+
+DEFAULT_CONFIG = {
+    'metrics': list(METRICS),
+    'keep_singletons': True,
+    'keep_split_antecedent': True,
+    'keep_bridging': False,
+    'keep_non_referring': False,
+    'only_split_antecedent': False,
+    'evaluate_discourse_deixis': False,
+    'all_layers': False,
+    'use_MIN': False,
+    'workers': 1,
+    'stream': False,
+    'key_cache_dir': None,
+    'docs': None}  # the names of the documents to score, None for all
+
+
+# the options that the settings of score_matrix can override
+MATRIX_OPTIONS = ('keep_singletons', 'keep_split_antecedent', 'keep_non_referring', 'use_MIN')
+
+# the settings of leaderboards, as (name, {option: value}) that override the
+# options of the config
+DEFAULT_MATRIX = [
+    ('default', {}),
+    ('no split-antecedents', {'keep_split_antecedent': False}),
+    ('coreference only', {'keep_singletons': False, 'keep_split_antecedent': False}),
+    ('non-referring', {'keep_non_referring': True}),
+    ('MIN', {'use_MIN': True}),
+    ('MIN coreference only', {'use_MIN': True, 'keep_singletons': False, 'keep_split_antecedent': False})]
+
+
+def get_config(config=None):
+  """Returns the DEFAULT_CONFIG updated with config. As on the command line,
+  only_split_antecedent, evaluate_discourse_deixis and all_layers override
+  the options they cannot be combined with."""
+  config = dict(DEFAULT_CONFIG, **(config or {}))
+  unknown = set(config) - set(DEFAULT_CONFIG)
+  if unknown:
+    raise ValueError('Unknown config options: %s' % ', '.join(sorted(unknown)))
+  get_metrics(config['metrics'])
+
+  if config['only_split_antecedent']:
+    config.update(keep_split_antecedent=True, keep_singletons=True, keep_bridging=False,
+        keep_non_referring=False)
+  if config['evaluate_discourse_deixis']:
+    config.update(keep_split_antecedent=True, keep_singletons=True, only_split_antecedent=False,
+        keep_bridging=False, keep_non_referring=False)
+  if config['all_layers']:
+    # the discourse deixis is scored as its own layer
+    config.update(keep_bridging=True, evaluate_discourse_deixis=False, only_split_antecedent=False)
+  return config
+
+
+def get_metrics(names):
+  """The [(name, metric)] of the metric names."""
+  unknown = [name for name in names if name not in METRICS]
+  if unknown:
+    raise ValueError('Unknown metrics: %s' % ', '.join(unknown))
+  return [(name, METRICS[name]) for name in names]
+
+
+def get_key_options(config):
+  """The reader options of the key documents, see reader.get_key_docs."""
+  return (config['keep_singletons'], config['keep_split_antecedent'], config['keep_bridging'],
+      config['keep_non_referring'], config['evaluate_discourse_deixis'], config['use_MIN'],
+      config['all_layers'])
+
+
+def score(key_file, sys_file, config=None, bootstrap=0, keep_document_counts=False):
+  """Scores the system file against the key file, see get_scores."""
+  return get_scores(key_file, sys_file, get_config(config), bootstrap=bootstrap,
+      keep_document_counts=keep_document_counts)
+
+
+def score_matrix(key_file, sys_file, settings=None, config=None, bootstrap=0):
+  """Scores the system file against the key file in every setting of
+  settings (DEFAULT_MATRIX by default), whose options override those of
+  the config. The files are read and their markables parsed only once, the
+  clusters of each setting are processed from the same markables. Returns
+  [(name, scores)] with the scores of get_scores of every setting."""
+  config = get_config(config)
+  for option in ('all_layers', 'only_split_antecedent', 'evaluate_discourse_deixis'):
+    # the last two override the options of the settings
+    if config[option]:
+      raise ValueError('The settings matrix cannot be combined with %s' % option)
+  setting_configs = []
+  for name, options in DEFAULT_MATRIX if settings is None else settings:
+    unknown = set(options) - set(MATRIX_OPTIONS)
+    if unknown:
+      raise ValueError('Unknown setting options: %s' % ', '.join(sorted(unknown)))
+    setting_config = get_config(dict(config, **options))
+    if setting_config['keep_split_antecedent'] and not setting_config['keep_singletons']:
+      # the members of the split-antecedents may be singletons
+      raise ValueError('The setting %s removes the singletons but keeps the split-antecedents' % name)
+    setting_configs.append((name, setting_config))
+
+  doc_infos = reader.iter_setting_coref_infos(key_file, sys_file, config['keep_bridging'],
+      config['evaluate_discourse_deixis'], [tuple(setting_config[option] for option in MATRIX_OPTIONS)
+          for _, setting_config in setting_configs],
+      stream=config['stream'], key_cache_dir=config['key_cache_dir'], docs=config['docs'],
+      workers=config['workers'])
+  # the infos of all the documents are kept to score one setting after the other
+  setting_doc_infos = [[] for _ in setting_configs]
+  for doc, infos in doc_infos:
+    for doc_infos_of_setting, info in zip(setting_doc_infos, infos):
+      doc_infos_of_setting.append((doc,) + info)
+  return [(name, get_doc_infos_scores(doc_infos_of_setting, setting_config, bootstrap))
+      for (name, setting_config), doc_infos_of_setting in zip(setting_configs, setting_doc_infos)]
+
+
+class Scorer:
+  """Scores system files against a key that is read and processed only once.
+  It can be pickled, e.g. to share the key with worker processes."""
+
+  def __init__(self, key_file, config=None):
+    self.key_file = key_file
+    self.config = get_config(config)
+    self.key_docs = reader.get_key_docs(key_file, get_key_options(self.config),
+        self.config['key_cache_dir'], self.config['docs'], self.config['workers'])
+
+  def score(self, sys_file, bootstrap=0, keep_document_counts=False):
+    return get_scores(self.key_file, sys_file, self.config, key_docs=self.key_docs,
+        bootstrap=bootstrap, keep_document_counts=keep_document_counts)
+
+  def score_spans(self, clusters, split_antecedents=None, bridging_pairs=None, non_referrings=None,
+      docs=None, bootstrap=0, keep_document_counts=False):
+    """Scores system clusters of (doc, start, end) spans, see
+    reader.get_span_docs, without writing them to a file. All the key
+    documents, or only those of docs (by default those of the config), are
+    scored."""
+    config = self.config
+    if config['all_layers']:
+      raise ValueError('Spans have no discourse deixis layer, score them without all_layers')
+    if docs is None:
+      docs = config['docs']
+    span_docs = reader.get_span_docs(clusters, split_antecedents, bridging_pairs, non_referrings)
+    doc_infos = reader.iter_span_coref_infos(self.key_docs, span_docs, config['keep_singletons'],
+        config['keep_split_antecedent'], config['keep_non_referring'], config['use_MIN'], docs=docs)
+    return get_doc_infos_scores(doc_infos, config, bootstrap=bootstrap,
+        keep_document_counts=keep_document_counts)
+
+
+def get_scores(key_file, sys_file, config, key_docs=None, bootstrap=0, keep_document_counts=False):
+  """Returns a dict with the [(name, (recall, precision, f1))] of the metrics,
+  the CoNLL score (None unless muc, bcub and ceafe are evaluated), the
+  non-referring and bridging scores (None unless they are evaluated), with
+  all_layers the {'metrics', 'conll'} of the discourse deixis, and
+  with bootstrap > 0 the [(name, (lower, upper))] 95% confidence intervals of
+  the F1 scores from that many bootstrap resamples of the documents.
+  With keep_document_counts it also has the scored documents and their
+  counts (see significance.get_count_array). config is a full config of
+  get_config."""
+  # in the stream mode the documents are read, scored and released one by one
+  options = {'stream': config['stream'], 'key_cache_dir': config['key_cache_dir'],
+      'key_docs': key_docs, 'docs': config['docs'], 'workers': config['workers']}
+  if config['all_layers']:
+    doc_infos = reader.iter_all_layer_coref_infos(key_file, sys_file, config['keep_singletons'],
+        config['keep_split_antecedent'], config['keep_non_referring'], config['use_MIN'], **options)
+  else:
+    doc_infos = reader.iter_coref_infos(key_file, sys_file, config['keep_singletons'],
+        config['keep_split_antecedent'], config['keep_bridging'], config['keep_non_referring'],
+        config['evaluate_discourse_deixis'], config['use_MIN'], **options)
+  return get_doc_infos_scores(doc_infos, config, bootstrap, keep_document_counts)
+
+
+def get_doc_infos_scores(doc_infos, config, bootstrap=0, keep_document_counts=False):
+  """The scores of get_scores of the documents of reader.iter_coref_infos,
+  reader.iter_all_layer_coref_infos or reader.iter_span_coref_infos."""
+  metrics = get_metrics(config['metrics'])
+  keep_non_referring = config['keep_non_referring']
+  keep_bridging = config['keep_bridging']
+
+  non_referring_counts = [0] * 3
+  bridging_counts = [0] * 9
+  documents = []
+  # the discourse deixis layer of all_layers is scored after the identity
+  discourse_deixis_infos = [] if config['all_layers'] else None
+
+  def get_coref_infos():
+    for doc_info in doc_infos:
+      doc, coref_info, non_referring_info, bridging_info = doc_info[:4]
+      documents.append(doc)
+      if discourse_deixis_infos is not None:
+        discourse_deixis_infos.append(doc_info[4])
+      if keep_non_referring:
+        for i, count in enumerate(evaluator.get_non_referring_counts(*non_referring_info)):
+          non_referring_counts[i] += count
+      if keep_bridging:
+        for i, count in enumerate(evaluator.get_bridging_counts(*bridging_info)):
+          bridging_counts[i] += count
+      yield coref_info
+
+  document_counts = [] if bootstrap or keep_document_counts else None
+  scores = evaluator.evaluate_metrics(get_coref_infos(),
+      metrics,
+      beta=1,
+      only_split_antecedent=config['only_split_antecedent'],
+      workers=config['workers'],
+      document_counts=document_counts)
+
+  discourse_deixis = None
+  if discourse_deixis_infos is not None:
+    discourse_deixis_scores = evaluator.evaluate_metrics(discourse_deixis_infos, metrics, beta=1,
+        workers=config['workers'])
+    discourse_deixis = {'metrics': discourse_deixis_scores,
+        'conll': get_conll(discourse_deixis_scores)}
+
+  if document_counts is not None:
+    document_counts = significance.get_count_array(metrics, document_counts)
+
+  return {
+      'metrics': scores,
+      'conll': get_conll(scores),
+      'non_referring': evaluator.get_non_referring_scores(non_referring_counts)
+          if keep_non_referring else None,
+      'bridging': evaluator.get_bridging_scores(bridging_counts) if keep_bridging else None,
+      'discourse_deixis': discourse_deixis,
+      'bootstrap': significance.bootstrap(metrics, document_counts, resamples=bootstrap,
+          only_split_antecedent=config['only_split_antecedent']) if bootstrap else None,
+      'documents': documents if keep_document_counts else None,
+      'document_counts': document_counts if keep_document_counts else None}
+
+
+def get_conll(scores):
+  """The CoNLL score of the [(name, (recall, precision, f1))] of the metrics,
+  None unless muc, bcub and ceafe are evaluated."""
+  conll = 0
+  conll_subparts_num = 0
+  for name, (recall, precision, f1) in scores:
+    if name in ["muc", "bcub", "ceafe"]:
+      conll += f1
+      conll_subparts_num += 1
+  return (conll / 3) * 100 if conll_subparts_num == 3 else None
+
+
+def get_json_scores(scores):
+  """The scores of get_scores as a dict that can be dumped as JSON, with a
+  {'recall', 'precision', 'f1'} dict per metric."""
+  json_scores = {}
+  for name, (recall, precision, f1) in scores['metrics']:
+    json_scores[name] = {'recall': recall, 'precision': precision, 'f1': f1}
+  json_scores['conll'] = scores['conll']
+  if scores['non_referring'] is not None:
+    json_scores['non_referring'] = dict(zip(('recall', 'precision', 'f1'), scores['non_referring']))
+  if scores['bridging'] is not None:
+    for name, score in zip(('bridging_ar', 'bridging_fbm', 'bridging_fbe'), scores['bridging']):
+      json_scores[name] = dict(zip(('recall', 'precision', 'f1'), score))
+  if scores['discourse_deixis'] is not None:
+    json_scores['discourse_deixis'] = {name: dict(zip(('recall', 'precision', 'f1'), score))
+        for name, score in scores['discourse_deixis']['metrics']}
+    json_scores['discourse_deixis']['conll'] = scores['discourse_deixis']['conll']
+  return json_scores
@@ -1,11 +1,61 @@
-from pytest import approx
-from coval.ua.reader import get_coref_infos
+from pytest import approx, raises
+from coval.ua.reader import get_coref_infos, iter_coref_infos, get_key_docs, get_doc_markables, get_all_docs
+from coval.ua.reader import process_clusters
 from coval.eval.evaluator import evaluate_documents as evaluate
 from coval.eval.evaluator import muc, b_cubed, ceafe, lea, ceafm,blancc,blancn
+from coval.eval.evaluator import evaluate_metrics, Evaluator, get_split_antecedent_info
+from coval.eval import significance
+from coval.ua.markable import SplitAntecedentMembers
+from coval.ua import doc_index
+from coval.ua import scorer
+from coval import profiling
+from benchmarks import generate
+import coval
+import numpy as np
+import gzip
+import itertools
+import lzma
+import math
+import os
+import pickle
 
 TOL = 1e-4
 #the test for blanc is not yet finished
 
+def write_corpus(tmp_path, **options):
+  """Writes the generated key and system documents of the generator options
+  to tmp_path/key and tmp_path/sys and returns them."""
+  key_docs, sys_docs = generate.generate(options)
+  generate.write_ua(str(tmp_path / 'key'), key_docs)
+  generate.write_ua(str(tmp_path / 'sys'), sys_docs)
+  return key_docs, sys_docs
+
+def write_discourse_deixis(path, source, markables):
+  """Writes the UA file source with single token discourse deixis markables
+  of {token: entity_id}."""
+  lines = []
+  with open(source) as f:
+    for line in f:
+      fields = line.split()
+      if fields and not line.startswith('#') and int(fields[0]) in markables:
+        token = int(fields[0])
+        fields[12] = '(EntityID=%s|MarkableID=dd%d)' % (markables[token], token)
+        line = '  '.join(fields) + '\n'
+      lines.append(line)
+  with open(path, 'w') as f:
+    f.write(''.join(lines))
+
+# the scores of TC-PA-9.sys in the default setting, as in test_PA9
+PA9_SCORES = {'lea': (7/8, 5.2/8, 0.74590), 'muc': (1, 11/15, 11/13), 'bcub': (1, 0.75463, 0.86016),
+    'ceafe': (0.69167, 0.92222, 0.79048), 'ceafm': (0.86111, 0.86111, 0.86111)}
+
+def assert_scores(scores, expected):
+  """Compares the metrics of get_scores with the expected (recall, precision,
+  f1) of some of them."""
+  metrics = dict(scores['metrics'])
+  for name, values in expected.items():
+    assert metrics[name] == approx(values, abs=TOL), name
+
 def read(key, response):
   doc_coref_infos, _, _ = get_coref_infos('plural-tests/%s' % key, 'plural-tests/%s' % response,
       True, True, False,False,False,False)
@@ -145,4 +195,401 @@ def test_PB4():
   assert evaluate(doc, ceafe) == approx([0.77143, 0.96429, 0.85714],abs=TOL)
   assert evaluate(doc, ceafm) == approx([0.8, 8/9, 0.84211],abs=TOL)
   assert evaluate(doc, lea) == approx([0.8, 7/9, 0.78873],abs=TOL)
-  # assert evaluate(doc, [blancc,blancn]) == (1,1,1)
\ No newline at end of file
+  # assert evaluate(doc, [blancc,blancn]) == (1,1,1)
+
+def test_ua_tokenizer():
+  lines = ['1 ( _ _ _ _ _ _ _ _ _ _ _ more',
+      '2\tthe\t_\t_\t_\t_\t_\t_\t_\t_\t(MarkableID=m1|Min=3|EntityID=1|ElementOf=3,4\t(MarkableID=m2|MentionAnchor=m1)\t_',
+      '3\tdogs\t_\t_\t_\t_\t_\t_\t_\t_\t)(EntityID=2-Pseudo|MarkableID=m2)\t_\t_\textra\tcolumns']
+  clusters, bridging_pairs = get_doc_markables('doc', lines, True, True)
+  assert list(clusters) == ['1', '2-Pseudo']
+  (m1,), ref_tag, _, _ = clusters['1']
+  assert (m1.start, m1.end, m1.MIN, ref_tag, m1.words) == (1, 2, (2, 2), 'referring', ['the', 'dogs'])
+  (m2,), ref_tag, _, _ = clusters['2-Pseudo']
+  assert (m2.start, m2.end, ref_tag) == (2, 2, 'non_referring')
+  assert bridging_pairs == {m2: m1}
+
+def test_evaluate_metrics():
+  metrics = [('lea', lea), ('muc', muc), ('bcub', b_cubed), ('ceafe', ceafe),
+      ('ceafm', ceafm), ('blanc', [blancc, blancn])]
+  for sys_file in ['TC-PA-5.sys', 'TC-PA-9.sys']:
+    doc = read('TC-PA.key', sys_file)
+    for only_split_antecedent in [False, True]:
+      scores = evaluate_metrics(doc, metrics, only_split_antecedent=only_split_antecedent)
+      assert scores == [(name, evaluate(doc, metric, only_split_antecedent=only_split_antecedent))
+          for name, metric in metrics]
+
+def test_blanc_split_antecedents():
+  # the scores of the pairwise BLANC that counted every mention pair
+  expected = {
+      'TC-PA-5.sys': [(0.9637681159420289, 0.9637681159420289, 0.9637681159420289), (1, 0.75, 0.8333333333333333)],
+      'TC-PA-9.sys': [(0.8681159420289856, 0.7857142857142858, 0.8156565656565657), (1, 0.5833333333333333, 0.7333333333333334)]}
+  for sys_file, (scores, split_antecedent_scores) in expected.items():
+    doc = read('TC-PA.key', sys_file)
+    assert evaluate(doc, [blancc, blancn]) == approx(scores, rel=1e-12)
+    assert evaluate(doc, [blancc, blancn], only_split_antecedent=True) == approx(split_antecedent_scores, rel=1e-12)
+
+def test_split_antecedent_pruning(tmp_path):
+  write_corpus(tmp_path, documents=2, mentions=100, split_antecedent_rate=0.3)
+  doc_coref_infos, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'sys'), True, True, False, False, False, False)
+  pruned = 0
+  for key_clusters, sys_clusters, _, _ in doc_coref_infos.values():
+    (key_split_antecedents, sys_split_antecedents, key_members, sys_members, sys_mention_key_clusters,
+        key_mention_sys_clusters, overlapping_pairs) = get_split_antecedent_info(key_clusters, sys_clusters)
+    # the pairs without common members score zero and their denominators
+    # only depend on one side
+    for metric in [muc, b_cubed, ceafe, ceafm, lea, blancc, blancn]:
+      evaluator = Evaluator(metric)
+      for i in range(len(key_split_antecedents)):
+        for j in range(len(sys_split_antecedents)):
+          if (i, j) in overlapping_pairs:
+            continue
+          pruned += 1
+          pn, pd, rn, rd = evaluator.__update__(key_members[i], sys_members[j], key_mention_sys_clusters[j],
+              sys_mention_key_clusters[i], is_split_alignment=True)
+          assert pn == rn == 0
+          assert pd == evaluator.__update__([], sys_members[j], {}, {}, is_split_alignment=True)[1]
+          assert rd == evaluator.__update__(key_members[i], [], {}, {}, is_split_alignment=True)[3]
+  assert pruned > 0
+
+def test_split_antecedent_cycle(tmp_path):
+  # entity 1 is the plural of 2 and 3 and entity 2 the plural of 1
+  lines = ['# global.columns = ID FORM LEMMA UPOS XPOS FEATS HEAD DEPREL DEPS MISC IDENTITY BRIDGING DISCOURSE_DEIXIS',
+      '# newdoc id = cycle']
+  for i, markable in enumerate(['(EntityID=1|MarkableID=a|ElementOf=2)', '(EntityID=2|MarkableID=b|ElementOf=1)',
+      '(EntityID=3|MarkableID=c|ElementOf=1)', '(EntityID=1|MarkableID=d)']):
+    lines.append('\t'.join([str(i + 1)] + ['_'] * 9 + [markable, '_', '_']))
+  (tmp_path / 'cycle').write_text('\n'.join(lines) + '\n')
+  doc_coref_infos, _, _ = get_coref_infos(str(tmp_path / 'cycle'), str(tmp_path / 'cycle'), True, True, False, False, False, False)
+  key_clusters = doc_coref_infos['cycle'][0]
+  split_antecedents = [m for cl in key_clusters for m in cl if m.is_split_antecedent]
+  # both plurals resolve to entity 3, so their clusters are merged
+  assert [[[m.start for m in cl] for cl in s.split_antecedent_members] for s in split_antecedents] == [[[2]]]
+  for metric in [muc, b_cubed, ceafe, lea]:
+    assert evaluate(doc_coref_infos, metric) == (1, 1, 1)
+
+def test_split_antecedent_members_pickle():
+  # a set rebuilt from these items in its iteration order iterates differently
+  members = SplitAntecedentMembers([45, 5, 20, 39, 7, 31])
+  unpickled = pickle.loads(pickle.dumps(members))
+  assert unpickled == members
+  assert list(unpickled) == list(members)
+
+def test_parallel_evaluation():
+  doc_coref_infos, _, _ = get_coref_infos('plural-tests/TC-PA.key', 'plural-tests/TC-PA.key',
+      True, True, False,False,False,False)
+  for sys_file in ['TC-PA-%d.sys' % i for i in range(4, 12)]:
+    doc_coref_infos[sys_file] = read('TC-PA.key', sys_file)['PluralTestCases/TC-PA']
+  for metric in [muc, b_cubed, ceafe, lea, [blancc, blancn]]:
+    assert evaluate(doc_coref_infos, metric, workers=3) == evaluate(doc_coref_infos, metric)
+
+def test_stream_out_of_order(tmp_path):
+  key_docs, sys_docs = [], []
+  for i in [4, 5, 9]:
+    key_docs.append(open('plural-tests/TC-PA.key').read().replace('TC-PA\n', 'TC-PA-%d\n' % i))
+    sys_docs.append(open('plural-tests/TC-PA-%d.sys' % i).read().replace('TC-PA\n', 'TC-PA-%d\n' % i))
+  (tmp_path / 'key').write_text(''.join(key_docs))
+  (tmp_path / 'sys').write_text(''.join(reversed(sys_docs[1:])))
+  options = (True, True, False, False, False, False)
+  doc_coref_infos, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'sys'), *options)
+  streamed = [(doc, coref_info) for doc, coref_info, _, _ in iter_coref_infos(
+      str(tmp_path / 'key'), str(tmp_path / 'sys'), *options)]
+  assert [doc for doc, _ in streamed] == list(doc_coref_infos) == ['PluralTestCases/TC-PA-5', 'PluralTestCases/TC-PA-9']
+  for metric in [muc, b_cubed, ceafe, lea]:
+    assert evaluate([coref_info for _, coref_info in streamed], metric) == evaluate(doc_coref_infos, metric)
+  # the offset index of the fallback is not saved without docs
+  assert not os.path.exists(doc_index.get_index_path(str(tmp_path / 'sys')))
+
+def test_key_cache(tmp_path):
+  options = ('plural-tests/TC-PA.key', 'plural-tests/TC-PA-9.sys', True, True, True, True, False, False)
+  doc_coref_infos, _, _ = get_coref_infos(*options)
+  for _ in range(2):
+    cached_coref_infos, _, _ = get_coref_infos(*options, key_cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    for metric in [muc, b_cubed, ceafe, lea]:
+      assert evaluate(cached_coref_infos, metric) == evaluate(doc_coref_infos, metric)
+  get_coref_infos(*options[:-1], True, key_cache_dir=str(tmp_path))
+  assert len(list(tmp_path.iterdir())) == 2
+
+def test_shared_key_docs():
+  options = (True, True, False, False, False, False)
+  key_docs = get_key_docs('plural-tests/TC-PA.key', options)
+  for i in [4, 7, 9, 4]:
+    doc_coref_infos, _, _ = get_coref_infos('plural-tests/TC-PA.key', 'plural-tests/TC-PA-%d.sys' % i, *options)
+    shared = [coref_info for _, coref_info, _, _ in iter_coref_infos(
+        'plural-tests/TC-PA.key', 'plural-tests/TC-PA-%d.sys' % i, *options, key_docs=key_docs)]
+    for metric in [muc, b_cubed, ceafe, lea, [blancc, blancn]]:
+      assert evaluate(shared, metric) == evaluate(doc_coref_infos, metric)
+
+def test_library_api():
+  config = {'metrics': ['muc', 'bcub', 'ceafe'], 'keep_bridging': True, 'keep_non_referring': True}
+  scores = coval.score('plural-tests/TC-PA.key', 'plural-tests/TC-PA-4.sys', config)
+  assert [name for name, _ in scores['metrics']] == config['metrics']
+  assert scores['conll'] == approx(sum(f1 for _, (_, _, f1) in scores['metrics']) / 3 * 100)
+  scorer = coval.Scorer('plural-tests/TC-PA.key', config)
+  for key_scorer in [scorer, scorer, pickle.loads(pickle.dumps(scorer))]:
+    assert key_scorer.score('plural-tests/TC-PA-4.sys') == scores
+  # as on the command line, only_split_antecedent drops the bridging
+  assert coval.score('plural-tests/TC-PA.key', 'plural-tests/TC-PA-4.sys',
+      dict(config, only_split_antecedent=True))['bridging'] is None
+  with raises(ValueError):
+    coval.score('plural-tests/TC-PA.key', 'plural-tests/TC-PA-4.sys', {'metrics': ['f1']})
+
+def test_score_spans(tmp_path):
+  _, sys_docs = write_corpus(tmp_path, documents=3, mentions=60, split_antecedent_rate=0.2)
+  # the generated markables as spans, with the clusters in reverse order
+  clusters, indexes, split_antecedents, non_referrings = [], {}, {}, []
+  for doc in sys_docs:
+    for start, end, entity_id, _ in doc['markables'].values():
+      if entity_id.endswith('-Pseudo'):
+        non_referrings.append((doc['name'], start, end))
+      else:
+        indexes.setdefault((doc['name'], entity_id), []).append((doc['name'], start, end))
+  entities = list(indexes)[::-1]
+  clusters = [indexes[entity] for entity in entities]
+  for doc in sys_docs:
+    for markable_id, element_of in doc['element_of'].items():
+      member = (doc['name'], doc['markables'][markable_id][2])
+      for entity_id in element_of:
+        if (doc['name'], entity_id) in indexes and member in indexes:
+          split_antecedents.setdefault(entities.index((doc['name'], entity_id)), []).append(entities.index(member))
+  bridging_pairs = [((doc['name'],) + doc['markables'][anaphor][:2], (doc['name'],) + doc['markables'][antecedent][:2])
+      for doc in sys_docs for anaphor, antecedent in doc['bridging'].items()]
+
+  for config in [{'keep_bridging': True, 'keep_non_referring': True}, {'use_MIN': True}, {'only_split_antecedent': True}]:
+    key_scorer = coval.Scorer(str(tmp_path / 'key'), config)
+    assert key_scorer.score_spans(clusters, split_antecedents, bridging_pairs, non_referrings) == key_scorer.score(str(tmp_path / 'sys'))
+  # the documents without spans have no system markables
+  scores = key_scorer.score_spans([cl for cl in clusters if cl[0][0] != 'doc0'], docs=['doc0'])
+  assert all(f1 == 0 for _, (_, _, f1) in scores['metrics'])
+  with raises(ValueError):
+    key_scorer.score_spans([[('doc0', 0, 0), ('doc1', 0, 0)]])
+  # TC-PA-9.sys as spans, whose third cluster has the first two as its split-antecedents
+  doc = 'PluralTestCases/TC-PA'
+  clusters = [[(doc, 0, 1), (doc, 3, 3)], [(doc, 0, 0), (doc, 4, 4), (doc, 6, 8)], [(doc, 9, 10), (doc, 11, 11)]]
+  scores = coval.Scorer('plural-tests/TC-PA.key').score_spans(clusters, {2: [0, 1]})
+  assert_scores(scores, PA9_SCORES)
+  assert scores['conll'] == approx((11/13 + 0.86016 + 0.79048) / 3 * 100, abs=TOL * 100)
+
+def test_docs(tmp_path):
+  key_docs, sys_docs = write_corpus(tmp_path, documents=5, mentions=40, split_antecedent_rate=0.2)
+  generate.write_ua(str(tmp_path / 'sys'), sys_docs[::-1])
+  generate.write_ua(str(tmp_path / 'key-subset'), [key_docs[1], key_docs[3]])
+  generate.write_ua(str(tmp_path / 'sys-subset'), [sys_docs[1], sys_docs[3]])
+  docs = [key_docs[3]['name'], key_docs[1]['name']]
+  expected = coval.score(str(tmp_path / 'key-subset'), str(tmp_path / 'sys-subset'))
+  for config in [{}, {'stream': True}, {'key_cache_dir': str(tmp_path / 'cache')}]:
+    assert coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), dict(config, docs=docs)) == expected
+  assert coval.Scorer(str(tmp_path / 'key'), {'docs': docs}).score(str(tmp_path / 'sys')) == expected
+  # the sidecar index is reused until the file changes
+  index = doc_index.load_doc_index(str(tmp_path / 'sys'))
+  assert list(index) == [doc['name'] for doc in sys_docs[::-1]]
+  with open(str(tmp_path / 'sys'), 'a') as f:
+    f.write('\n')
+  assert doc_index.load_doc_index(str(tmp_path / 'sys')) is None
+  assert os.path.exists(doc_index.get_index_path(str(tmp_path / 'key')))
+
+def test_compressed_files(tmp_path):
+  key_docs, sys_docs = write_corpus(tmp_path, documents=4, mentions=40, split_antecedent_rate=0.2)
+  # out of the key order, which the stream mode reads at once from a compressed file
+  generate.write_ua(str(tmp_path / 'sys'), sys_docs[::-1])
+  for name, open_compressed in [('key', gzip.open), ('sys', lzma.open)]:
+    with open(str(tmp_path / name), 'rb') as f, open_compressed(str(tmp_path / (name + '.compressed')), 'wb') as out:
+      out.write(f.read())
+  docs = [key_docs[2]['name'], key_docs[0]['name']]
+  for config in [{}, {'stream': True}, {'docs': docs}]:
+    assert (coval.score(str(tmp_path / 'key.compressed'), str(tmp_path / 'sys.compressed'), config)
+        == coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), config))
+
+def test_corpus(tmp_path):
+  key_docs, sys_docs = write_corpus(tmp_path, documents=6, mentions=40, split_antecedent_rate=0.2)
+  # one file per document, the system files in another order than the key files
+  for name, docs in [('key-corpus', key_docs), ('sys-corpus', sys_docs[::-1])]:
+    for i, doc in enumerate(docs):
+      (tmp_path / name / str(i // 4)).mkdir(parents=True, exist_ok=True)
+      generate.write_ua(str(tmp_path / name / str(i // 4) / ('%d.conllu' % i)), [doc])
+  expected = coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'))
+  for config in [{}, {'workers': 2}, {'stream': True}]:
+    assert coval.score(str(tmp_path / 'key-corpus'), str(tmp_path / 'sys-corpus'), config) == expected
+    assert coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys-corpus' / '*' / '*.conllu'), config) == expected
+  # the documents of a corpus are selected while reading, no index is written into it
+  docs = [key_docs[4]['name'], key_docs[1]['name']]
+  assert (coval.score(str(tmp_path / 'key-corpus'), str(tmp_path / 'sys-corpus'), {'docs': docs})
+      == coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), {'docs': docs}))
+  assert not list((tmp_path / 'key-corpus').glob('**/*.idx')) and not list((tmp_path / 'sys-corpus').glob('**/*.idx'))
+  with raises(FileNotFoundError):
+    coval.score(str(tmp_path / 'key'), str(tmp_path / 'missing' / '*.conllu'))
+
+def test_all_layers(tmp_path):
+  write_corpus(tmp_path, documents=3, mentions=60, split_antecedent_rate=0.2,
+      discourse_deixis_rate=0.2)
+  for config in [{}, {'use_MIN': True}, {'keep_non_referring': True}]:
+    scores = coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), dict(config, all_layers=True))
+    identity = coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), dict(config, keep_bridging=True))
+    discourse_deixis = coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'),
+        dict(config, evaluate_discourse_deixis=True))
+    assert scores == dict(identity, discourse_deixis={'metrics': discourse_deixis['metrics'],
+        'conll': discourse_deixis['conll']})
+  with raises(ValueError):
+    coval.Scorer(str(tmp_path / 'key'), {'all_layers': True}).score_spans([])
+  # TC-PA with a discourse deixis layer of the key clusters {2, 3} and {5, 6, 8}
+  # of single tokens and the system clusters {2, 3, 5} and {6, 8}
+  write_discourse_deixis(str(tmp_path / 'dd-key'), 'plural-tests/TC-PA.key', {2: 'A', 3: 'A', 5: 'B', 6: 'B', 8: 'B'})
+  write_discourse_deixis(str(tmp_path / 'dd-sys'), 'plural-tests/TC-PA-9.sys', {2: 'A', 3: 'A', 5: 'A', 6: 'B', 8: 'B'})
+  scores = coval.score(str(tmp_path / 'dd-key'), str(tmp_path / 'dd-sys'), {'all_layers': True})
+  assert_scores(scores, PA9_SCORES)
+  # muc: 1 of the 3 links of the key clusters and of the system clusters
+  # are lost by the other side, b3: (4/2 + 1/3 + 4/3) / 5 = 11/15, ceafe:
+  # (4/5 + 4/5) / 2, ceafm: (2 + 2) / 5, lea: (2 * 1 + 3 * 1/3) / 5 and blanc:
+  # 2 of 4 coreference and 4 of 6 non-coreference links are common
+  assert_scores(scores['discourse_deixis'], {'muc': (2/3, 2/3, 2/3), 'bcub': (11/15, 11/15, 11/15),
+      'ceafe': (0.8, 0.8, 0.8), 'ceafm': (0.8, 0.8, 0.8), 'lea': (0.6, 0.6, 0.6), 'blanc': (7/12, 7/12, 7/12)})
+  assert scores['discourse_deixis']['conll'] == approx(220 / 3)
+
+def test_score_matrix(tmp_path):
+  write_corpus(tmp_path, documents=3, mentions=60, split_antecedent_rate=0.2)
+  for config in [{}, {'keep_bridging': True, 'stream': True}]:
+    matrix = coval.score_matrix(str(tmp_path / 'key'), str(tmp_path / 'sys'), config=config)
+    assert [name for name, _ in matrix] == [name for name, _ in scorer.DEFAULT_MATRIX]
+    for (_, scores), (_, options) in zip(matrix, scorer.DEFAULT_MATRIX):
+      assert scores == coval.score(str(tmp_path / 'key'), str(tmp_path / 'sys'), dict(config, **options))
+  # TC-PA-9.sys joins the key singleton e to the cluster of c and d
+  matrix = dict(coval.score_matrix('plural-tests/TC-PA.key', 'plural-tests/TC-PA-9.sys'))
+  for name in ['default', 'non-referring', 'MIN']:
+    assert_scores(matrix[name], PA9_SCORES)
+  # b3 precision: (4/2 + 4/3 + 1/3 + 4/2) / 7, ceafe: 2.8 of 4 key and 3
+  # system entities, lea recall: (2 + 2 + 0 + 2) / 7 with e unresolved
+  assert_scores(matrix['no split-antecedents'], {'muc': (1, 3/4, 6/7), 'bcub': (1, 17/21, 17/19),
+      'ceafe': (0.7, 2.8/3, 0.8), 'ceafm': (6/7, 6/7, 6/7), 'lea': (6/7, 5/7, 60/77)})
+  # without the singleton e, b3 precision: (4/2 + 4/3 + 0 + 4/2) / 7
+  for name in ['coreference only', 'MIN coreference only']:
+    assert_scores(matrix[name], {'muc': (1, 3/4, 6/7), 'bcub': (1, 16/21, 32/37),
+        'ceafe': (14/15, 14/15, 14/15), 'ceafm': (1, 6/7, 12/13), 'lea': (1, 5/7, 5/6)})
+  # the clusters are processed in every setting without being changed
+  clusters, _ = get_doc_markables('doc0', get_all_docs(str(tmp_path / 'key'))['doc0'], False, False)
+  sizes = {cid: len(cl[0]) for cid, cl in clusters.items()}
+  split_antecedent_members = {}
+  processed = [process_clusters(clusters, True, False, True, split_antecedent_members)[0] for _ in range(2)]
+  assert {cid: len(cl[0]) for cid, cl in clusters.items()} == sizes
+  # the settings share the members of the plural clusters
+  assert split_antecedent_members
+  assert [{id(m.split_antecedent_members) for cl in p for m in cl if m.is_split_antecedent}
+      for p in processed] == [{id(members) for members in split_antecedent_members.values()}] * 2
+  with raises(ValueError):
+    coval.score_matrix(str(tmp_path / 'key'), str(tmp_path / 'sys'), [('metrics', {'metrics': ['muc']})])
+  # these modes would override the options of the settings
+  for config in [{'only_split_antecedent': True}, {'evaluate_discourse_deixis': True}]:
+    with raises(ValueError):
+      coval.score_matrix(str(tmp_path / 'key'), str(tmp_path / 'sys'), config=config)
+  with raises(ValueError):
+    coval.score_matrix(str(tmp_path / 'key'), str(tmp_path / 'sys'), [('singletons', {'keep_singletons': False})])
+
+def test_bootstrap():
+  metrics = [('muc', muc), ('bcub', b_cubed), ('ceafe', ceafe), ('blanc', [blancc, blancn])]
+  doc_coref_infos = {}
+  for i in range(1, 12):
+    infos, _, _ = get_coref_infos('plural-tests/TC-PA.key', 'plural-tests/TC-PA-%d.sys' % i,
+        True, True, False, False, False, False)
+    doc_coref_infos[i] = infos['PluralTestCases/TC-PA']
+  document_counts = []
+  scores = evaluate_metrics(doc_coref_infos, metrics, document_counts=document_counts)
+  counts = significance.get_count_array(metrics, document_counts)
+  assert counts.shape == (11, 5, 8)
+  for (_, score), (_, vectorized) in zip(scores, significance.get_scores(metrics, counts.sum(axis=0))):
+    assert [float(s) for s in vectorized] == approx(list(score))
+  intervals = significance.bootstrap(metrics, counts, resamples=500)
+  assert [name for name, _ in intervals] == ['muc', 'bcub', 'ceafe', 'blanc', 'conll']
+  assert intervals == significance.bootstrap(metrics, counts, resamples=500)
+  for (_, (_, _, f)), (_, (lower, upper)) in zip(scores, intervals):
+    assert lower <= f <= upper
+  # e.g. with --docs of documents that are not in the key
+  empty = significance.get_count_array(metrics, [])
+  intervals = significance.bootstrap(metrics, empty, resamples=10)
+  assert [name for name, _ in intervals] == ['muc', 'bcub', 'ceafe', 'blanc', 'conll']
+  assert all(math.isnan(lower) and math.isnan(upper) for _, (lower, upper) in intervals)
+  assert all(math.isnan(p) for _, p in significance.randomization_test(metrics, empty, empty, permutations=10))
+
+def test_randomization_test():
+  metrics = [('muc', muc), ('bcub', b_cubed), ('ceafe', ceafe), ('lea', lea)]
+  all_counts = []
+  for i in range(1, 12):
+    document_counts = []
+    doc_coref_infos, _, _ = get_coref_infos('plural-tests/TC-PA.key', 'plural-tests/TC-PA-%d.sys' % i,
+        True, True, False, False, False, False)
+    evaluate_metrics(doc_coref_infos, metrics, document_counts=document_counts)
+    all_counts.append(significance.get_count_array(metrics, document_counts)[0])
+  # system b has the correct output of TC-PA-1 for five of the documents
+  counts_a = np.array(all_counts)
+  counts_b = np.array([all_counts[0] if i in [3, 5, 6, 8, 9] else counts for i, counts in enumerate(all_counts)])
+  assert [p for _, p in significance.randomization_test(metrics, counts_a, counts_a, permutations=100)] == [1] * 5
+
+  names, f1s_a = significance.get_f1s(significance.get_scores(metrics, counts_a.sum(axis=0)))
+  _, f1s_b = significance.get_f1s(significance.get_scores(metrics, counts_b.sum(axis=0)))
+  at_least_as_different = np.zeros(len(names))
+  for swaps in itertools.product([0, 1], repeat=11):
+    swaps = np.array(swaps)[:, None, None]
+    _, permuted_a = significance.get_f1s(significance.get_scores(metrics, (counts_a * (1 - swaps) + counts_b * swaps).sum(axis=0)))
+    _, permuted_b = significance.get_f1s(significance.get_scores(metrics, (counts_b * (1 - swaps) + counts_a * swaps).sum(axis=0)))
+    at_least_as_different += np.abs(permuted_a - permuted_b) >= np.abs(f1s_a - f1s_b) - 1e-12
+  p_values = significance.randomization_test(metrics, counts_a, counts_b, permutations=20000)
+  assert [name for name, _ in p_values] == names
+  assert [p for _, p in p_values] == approx(list(at_least_as_different / 2 ** 11), abs=0.02)
+
+def test_profiling():
+  options = ('plural-tests/TC-PA.key', 'plural-tests/TC-PA-7.sys', True, True, False, False, False, False)
+  doc_coref_infos, _, _ = get_coref_infos(*options)
+  profiling.enable()
+  try:
+    profiled = [coref_info for _, coref_info, _, _ in iter_coref_infos(*options)]
+    assert evaluate(profiled, ceafe) == evaluate(doc_coref_infos, ceafe)
+    assert evaluate(profiled, muc) == evaluate(doc_coref_infos, muc)
+    report = profiling.get_report()
+  finally:
+    profiling.disable()
+  stages = {s['stage']: s['calls'] for s in report['stages']}
+  assert stages['read documents'] == stages['metric ceafe'] == 2
+  assert stages['read markables'] == stages['process clusters'] == 2
+  assert report['counters']['documents'] == 1
+  assert report['counters']['key markables'] == sum(len(cl) for cl in doc_coref_infos['PluralTestCases/TC-PA'][0])
+  assert 0 < report['counters']['mention lookup hits (muc)'] <= report['counters']['mention lookups (muc)']
+  assert report['counters']['contingency cells (ceafe)'] > 0
+  assert 'mention lookups (ceafe)' not in report['counters']
+  assert [d['document'] for d in report['slowest_documents']] == ['PluralTestCases/TC-PA']
+  assert 'metric ceafe' in profiling.format_report(report)
+
+def test_benchmark_generator(tmp_path):
+  config = {'documents': 3, 'mentions': 60, 'split_antecedent_rate': 0.2}
+  key_docs, sys_docs = generate.generate(config)
+  generate.write_ua(str(tmp_path / 'key'), key_docs)
+  generate.write_ua(str(tmp_path / 'sys'), sys_docs)
+  generate.write_ua(str(tmp_path / 'sys2'), generate.generate(config)[1])
+  assert (tmp_path / 'sys').read_text() == (tmp_path / 'sys2').read_text()
+
+  doc_coref_infos, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'key'), True, True, True, True, False, False)
+  assert len(doc_coref_infos) == 3
+  assert any(m.is_split_antecedent for key_clusters, _, _, _ in doc_coref_infos.values() for cl in key_clusters for m in cl)
+  for metric in [muc, b_cubed, ceafe, lea]:
+    assert evaluate(doc_coref_infos, metric) == (1, 1, 1)
+  doc_coref_infos, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'sys'), True, True, True, True, False, False)
+  assert evaluate(doc_coref_infos, muc)[2] < 1
+
+def write_ua_doc(path, markables):
+  lines = ['# newdoc id = TC-MIN']
+  for i in range(1, 7):
+    lines.append('%d  _  _  _  _  _  _  _  _  _  %s  _  _' % (i, markables.get(i, '_')))
+  path.write_text('\n'.join(lines) + '\n')
+
+def test_MIN(tmp_path):
+  write_ua_doc(tmp_path / 'key', {
+      1: '(EntityID=1|MarkableID=m1|Min=2', 3: ')',
+      5: '(EntityID=1|MarkableID=m2|Min=5)'})
+  write_ua_doc(tmp_path / 'sys', {
+      2: '(EntityID=1|MarkableID=m1', 3: ')',
+      5: '(EntityID=1|MarkableID=m2)'})
+  doc, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'sys'),
+      True, True, False, False, False, True)
+  for metric in [muc, b_cubed, ceafe, ceafm, lea, [blancc, blancn]]:
+    assert evaluate(doc, metric) == (1, 1, 1)
+  doc, _, _ = get_coref_infos(str(tmp_path / 'key'), str(tmp_path / 'sys'),
+      True, True, False, False, False, False)
+  assert evaluate(doc, muc) == (0, 0, 0)
@@ -1,136 +1,359 @@
+import os
 import sys
-from coval.ua import reader
-from coval.eval import evaluator
-from coval.eval.evaluator import evaluate_non_referrings
+import glob
+import json
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from coval.ua import scorer
+from coval.eval import significance
+from coval import profiling
 
 __author__ = 'ns-moosavi; juntaoy'
 
 
+# the options that are followed by a value, which is not a flag
+VALUE_OPTIONS = ('--jobs', '--key-cache', '--docs', '--bootstrap', '--compare', '--permutations',
+    '--matrix')
+
+
 def main():
-  metric_dict = {
-      'lea': evaluator.lea, 'muc': evaluator.muc,
-      'bcub': evaluator.b_cubed, 'ceafe': evaluator.ceafe,
-      'ceafm':evaluator.ceafm, 'blanc':[evaluator.blancc,evaluator.blancn]}
   key_file = sys.argv[1]
   sys_file = sys.argv[2]
+  config = {}
+  flags = get_flags(sys.argv[3:])
 
-  if 'remove_singletons' in sys.argv or 'remove_singleton' in sys.argv:
-    keep_singletons = False
-  else:
-    keep_singletons = True
+  if 'remove_singletons' in flags or 'remove_singleton' in flags:
+    config['keep_singletons'] = False
 
-  if 'remove_split_antecedent' in sys.argv or 'remove_split_antecedents' in sys.argv:
-    keep_split_antecedent = False
-  else:
-    keep_split_antecedent = True
+  if 'remove_split_antecedent' in flags or 'remove_split_antecedents' in flags:
+    config['keep_split_antecedent'] = False
 
-  if 'MIN' in sys.argv or 'min' in sys.argv or 'min_spans' in sys.argv:
-    use_MIN = True
-  else:
-    use_MIN = False
+  if 'MIN' in flags or 'min' in flags or 'min_spans' in flags:
+    config['use_MIN'] = True
 
-  if 'keep_non_referring' in sys.argv or 'keep_non_referrings' in sys.argv:
-    keep_non_referring = True
-  else:
-    keep_non_referring = False
+  if 'keep_non_referring' in flags or 'keep_non_referrings' in flags:
+    config['keep_non_referring'] = True
 
-  if 'keep_bridging' in sys.argv or 'keep_bridgings' in sys.argv:
-    keep_bridging = True
-  else:
-    keep_bridging = False
-
-  if 'only_split_antecedent' in sys.argv or 'only_split_antecedents' in sys.argv:
-    only_split_antecedent = True
-    keep_split_antecedent = True
-    keep_singletons = True
-    keep_bridging = False
-    keep_non_referring=False
-  else:
-    only_split_antecedent = False
-
-  if 'evaluate_discourse_deixis' in sys.argv:
-    evaluate_discourse_deixis = True
-    keep_split_antecedent = True
-    keep_singletons = True
-    only_split_antecedent = False
-    keep_bridging = False
-    keep_non_referring = False
-  else:
-    evaluate_discourse_deixis = False
+  if 'keep_bridging' in flags or 'keep_bridgings' in flags:
+    config['keep_bridging'] = True
 
-  if 'all' in sys.argv:
-    metrics = [(k, metric_dict[k]) for k in metric_dict]
-  else:
-    metrics = []
-    for name in metric_dict:
-      if name in sys.argv:
-        
-        metrics.append((name, metric_dict[name]))
+  if 'only_split_antecedent' in flags or 'only_split_antecedents' in flags:
+    config['only_split_antecedent'] = True
+
+  if 'evaluate_discourse_deixis' in flags:
+    config['evaluate_discourse_deixis'] = True
+
+  if 'all_layers' in flags:
+    config['all_layers'] = True
+
+  config['stream'] = 'stream' in flags
+
+  if '--jobs' in sys.argv:
+    config['workers'] = int(sys.argv[sys.argv.index('--jobs') + 1])
+
+  if '--key-cache' in sys.argv:
+    config['key_cache_dir'] = sys.argv[sys.argv.index('--key-cache') + 1]
+
+  if '--docs' in sys.argv:
+    config['docs'] = get_docs(sys.argv[sys.argv.index('--docs') + 1])
+
+  bootstrap = 0
+  if '--bootstrap' in sys.argv:
+    bootstrap = int(sys.argv[sys.argv.index('--bootstrap') + 1])
+
+  compare_file = None
+  if '--compare' in sys.argv:
+    compare_file = sys.argv[sys.argv.index('--compare') + 1]
 
-  if len(metrics) == 0:
-    metrics = [(name, metric_dict[name]) for name in metric_dict]
+  permutations = 10000
+  if '--permutations' in sys.argv:
+    permutations = int(sys.argv[sys.argv.index('--permutations') + 1])
+
+  profile = None
+  if '--profile' in sys.argv:
+    profile_index = sys.argv.index('--profile') + 1
+    profile = 'json' if sys.argv[profile_index:profile_index + 1] == ['json'] else 'table'
+    profiling.enable()
+
+  batch = 'batch' in flags
+  jsonl = 'jsonl' in flags
+
+  settings = None
+  if '--matrix' in sys.argv:
+    settings = get_matrix(sys.argv[sys.argv.index('--matrix') + 1])
+  elif 'matrix' in flags:
+    settings = scorer.DEFAULT_MATRIX
+
+  if 'all' not in flags:
+    metrics = [name for name in scorer.METRICS if name in flags]
+    if metrics:
+      config['metrics'] = metrics
+
+  config = scorer.get_config(config)
 
   msg = ""
-  if evaluate_discourse_deixis:
+  if config['evaluate_discourse_deixis']:
     msg = 'only discourse deixis'
-  elif only_split_antecedent:
+  elif config['only_split_antecedent']:
     msg = 'only split-antecedents'
   else:
     msg = 'corferent markables'
-    if keep_singletons:
+    if config['keep_singletons']:
       msg+= ', singletons'
-    if keep_split_antecedent:
+    if config['keep_split_antecedent']:
       msg+=', split-antecedents'
-    if keep_non_referring:
+    if config['keep_non_referring']:
       msg+=', non-referring mentions'
-    if keep_bridging:
+    if config['keep_bridging']:
       msg+=', bridging relations'
+    if config['all_layers']:
+      msg+=', discourse deixis'
 
 
+  if batch:
+    sys_files = get_sys_files(sys_file)
+
+  # in the batch and matrix modes only the table or the JSONL rows go to the
+  # stdout
   print('The scorer is evaluating ', msg,
-      (" using the minimum span evaluation setting " if use_MIN else ""))
+      (" using the minimum span evaluation setting " if config['use_MIN'] else ""),
+      file=sys.stderr if batch or settings is not None else sys.stdout)
 
-  evaluate(key_file, sys_file, metrics, keep_singletons,keep_split_antecedent,keep_bridging,
-      keep_non_referring,only_split_antecedent,evaluate_discourse_deixis, use_MIN)
+  if batch:
+    evaluate_batch(key_file, sys_files, config, jsonl)
+  elif settings is not None:
+    evaluate_matrix(key_file, sys_file, settings, config, jsonl)
+  else:
+    evaluate(key_file, sys_file, config, bootstrap, compare_file, permutations)
 
+  # the profile goes to the stderr so that it does not mix with the scores
+  if profile == 'json':
+    print(json.dumps(profiling.get_report(), indent=2), file=sys.stderr)
+  elif profile == 'table':
+    print(profiling.format_report(profiling.get_report()), file=sys.stderr)
 
-def evaluate(key_file, sys_file, metrics, keep_singletons, keep_split_antecedent, keep_bridging,
-    keep_non_referring, only_split_antecedent,evaluate_discourse_deixis, use_MIN):
 
-  doc_coref_infos, doc_non_referring_infos, doc_bridging_infos = reader.get_coref_infos(key_file, sys_file, keep_singletons,
-      keep_split_antecedent, keep_bridging, keep_non_referring,evaluate_discourse_deixis,use_MIN)
+def evaluate(key_file, sys_file, config, bootstrap=0, compare_file=None, permutations=10000):
+  if compare_file is None:
+    scores = scorer.score(key_file, sys_file, config, bootstrap=bootstrap)
+  else:
+    # both system files of a comparison are scored against the same parsed key
+    key_scorer = scorer.Scorer(key_file, config)
+    scores = key_scorer.score(sys_file, bootstrap=bootstrap, keep_document_counts=True)
+  print_scores(scores)
 
-  conll = 0
-  conll_subparts_num = 0
+  if compare_file is not None:
+    compare_scores = key_scorer.score(compare_file, keep_document_counts=True)
+    print_comparison(scorer.get_metrics(config['metrics']), scores, compare_scores, compare_file,
+        permutations, config['only_split_antecedent'])
 
-  for name, metric in metrics:  
-    recall, precision, f1 = evaluator.evaluate_documents(doc_coref_infos,
-        metric,
-        beta=1,
-        only_split_antecedent=only_split_antecedent)
-    if name in ["muc", "bcub", "ceafe"]:
-      conll += f1
-      conll_subparts_num += 1
 
-    print(name)
-    print('Recall: %.2f' % (recall * 100),
-        ' Precision: %.2f' % (precision * 100),
-        ' F1: %.2f' % (f1 * 100))
+def print_comparison(metrics, scores, compare_scores, compare_file, permutations,
+    only_split_antecedent=False):
+  """Prints the F1 scores of the compared system file and the p-values of a
+  paired approximate randomization test on the documents of both files."""
+  compare_documents = {doc: i for i, doc in enumerate(compare_scores['documents'])}
+  pairs = [(i, compare_documents[doc]) for i, doc in enumerate(scores['documents'])
+      if doc in compare_documents]
+  p_values = significance.randomization_test(metrics,
+      scores['document_counts'][[i for i, _ in pairs]],
+      compare_scores['document_counts'][[j for _, j in pairs]],
+      permutations=permutations, only_split_antecedent=only_split_antecedent)
+
+  print('============================================')
+  print('Paired approximate randomization test (%d permutations) against %s:'
+      % (permutations, compare_file))
+  if len(pairs) < max(len(scores['documents']), len(compare_scores['documents'])):
+    print('Only the %d documents of both system files are compared.' % len(pairs))
+  f1s = [f1 * 100 for _, (_, _, f1) in scores['metrics']]
+  compare_f1s = [f1 * 100 for _, (_, _, f1) in compare_scores['metrics']]
+  if scores['conll'] is not None:
+    f1s.append(scores['conll'])
+    compare_f1s.append(compare_scores['conll'])
+  for (name, p_value), f1, compare_f1 in zip(p_values, f1s, compare_f1s):
+    print('%s: %.2f vs %.2f' % (name + ' F1' if name != 'conll' else 'CoNLL score', f1, compare_f1),
+        ' p-value: %.4f' % p_value)
+
+
+def get_flags(args):
+  """The arguments without the values of VALUE_OPTIONS, e.g. a --matrix
+  setting MIN is not the MIN flag."""
+  flags = []
+  skip = False
+  for arg in args:
+    if not skip:
+      flags.append(arg)
+    skip = arg in VALUE_OPTIONS and not skip
+  return flags
+
+
+def get_docs(docs):
+  """The documents to score are given either by a file that lists one
+  document name per line or as a comma-separated list."""
+  if os.path.isfile(docs):
+    with open(docs) as f:
+      return [line.strip() for line in f if line.strip()]
+  return docs.split(',')
 
-  if conll_subparts_num == 3:
-    conll = (conll / 3) * 100
-    print('CoNLL score: %.2f' % conll)
 
-  if keep_non_referring:
-    recall, precision, f1 = evaluate_non_referrings(
-        doc_non_referring_infos)
+def get_sys_files(sys_files):
+  """The system files of the batch mode are given either by a glob pattern
+  or by a file that lists one system file per line."""
+  if any(c in sys_files for c in '*?['):
+    files = sorted(glob.glob(sys_files))
+    if not files:
+      sys.exit('No system files match %s' % sys_files)
+    return files
+  with open(sys_files) as f:
+    files = [line.strip() for line in f if line.strip()]
+  if not files:
+    sys.exit('No system files are listed in %s' % sys_files)
+  return files
+
+
+def evaluate_batch(key_file, sys_files, config, jsonl=False):
+  """Scores each of the system files against the key, which is only read
+  once. With more than one worker the system files are scored in parallel.
+  Prints a table of the F1 scores, or with jsonl a JSON row per system file."""
+  workers = config['workers']
+  # the workers score one system file each
+  key_scorer = scorer.Scorer(key_file, dict(config, workers=1))
+
+  if workers > 1 and len(sys_files) > 1:
+    with ProcessPoolExecutor(min(workers, len(sys_files)), initializer=init_batch_worker,
+        initargs=(key_scorer,)) as executor:
+      if profiling.enabled:
+        all_scores = map(merge_batch_profile, executor.map(get_profiled_batch_scores, sys_files))
+      else:
+        all_scores = executor.map(get_batch_scores, sys_files)
+      print_batch_scores(sys_files, all_scores, config['metrics'], jsonl)
+  else:
+    init_batch_worker(key_scorer)
+    print_batch_scores(sys_files, map(get_batch_scores, sys_files), config['metrics'], jsonl)
+
+
+def print_batch_scores(sys_files, all_scores, metrics, jsonl=False):
+  """Prints the scores of the system files as soon as they are computed."""
+  names = metrics + ['conll']
+  if not jsonl:
+    width = max([len(sys_file) for sys_file in sys_files] + [6])
+    print('system'.ljust(width), *['%7s' % name for name in names])
+  for sys_file, scores in zip(sys_files, all_scores):
+    if jsonl:
+      row = {'system': sys_file}
+      row.update(scorer.get_json_scores(scores))
+      print(json.dumps(row), flush=True)
+    else:
+      f1s = [f1 * 100 for _, (_, _, f1) in scores['metrics']] + [scores['conll']]
+      print(sys_file.ljust(width), *['%7s' % ('-' if f1 is None else '%.2f' % f1) for f1 in f1s],
+          flush=True)
+
+
+def evaluate_matrix(key_file, sys_file, settings, config, jsonl=False):
+  """Scores the system file in every setting, reading the files only once.
+  Prints a table of the F1 scores, with the non-referring and bridging F1
+  scores of the settings that evaluate them, or with jsonl a JSON row per
+  setting."""
+  try:
+    all_scores = scorer.score_matrix(key_file, sys_file, settings, config)
+  except ValueError as e:
+    sys.exit(str(e))
+  names = config['metrics'] + ['conll']
+  if any(scores['non_referring'] is not None for _, scores in all_scores):
+    names.append('non_referring')
+  if config['keep_bridging']:
+    names += ['bridging_ar', 'bridging_fbm', 'bridging_fbe']
+  if not jsonl:
+    width = max([len(name) for name, _ in settings] + [7])
+    print('setting'.ljust(width), *['%7s' % name for name in names])
+  for name, scores in all_scores:
+    if jsonl:
+      row = {'setting': name}
+      row.update(scorer.get_json_scores(scores))
+      print(json.dumps(row), flush=True)
+    else:
+      f1s = [f1 * 100 for _, (_, _, f1) in scores['metrics']] + [scores['conll']]
+      if 'non_referring' in names:
+        f1s.append(None if scores['non_referring'] is None else scores['non_referring'][2] * 100)
+      if scores['bridging'] is not None:
+        f1s += [f1 * 100 for _, _, f1 in scores['bridging']]
+      print(name.ljust(width), *[('-' if f1 is None else '%.2f' % f1).rjust(max(7, len(column)))
+          for f1, column in zip(f1s, names)], flush=True)
+
+
+# the options of the settings of --matrix
+MATRIX_SETTING_OPTIONS = {
+    'remove_singletons': ('keep_singletons', False),
+    'remove_split_antecedent': ('keep_split_antecedent', False),
+    'keep_non_referring': ('keep_non_referring', True),
+    'MIN': ('use_MIN', True)}
+
+
+def get_matrix(matrix):
+  """The settings of --matrix are separated by semicolons, each is 'default'
+  or options of MATRIX_SETTING_OPTIONS joined by '+', e.g.
+  'default;remove_singletons+remove_split_antecedent;MIN'."""
+  settings = []
+  for name in matrix.split(';'):
+    options = {}
+    for option in name.split('+'):
+      if option == 'default':
+        continue
+      if option not in MATRIX_SETTING_OPTIONS:
+        sys.exit('Unknown option %s of the --matrix setting %s' % (option, name))
+      key, value = MATRIX_SETTING_OPTIONS[option]
+      options[key] = value
+    if options.get('keep_singletons') is False and options.get('keep_split_antecedent') is not False:
+      sys.exit('The --matrix setting %s has to remove the split-antecedents with the singletons, '
+          'e.g. remove_singletons+remove_split_antecedent' % name)
+    settings.append((name, options))
+  return settings
+
+
+batch_scorer = None
+
+
+def init_batch_worker(key_scorer):
+  global batch_scorer
+  batch_scorer = key_scorer
+
+
+def get_batch_scores(sys_file):
+  # the messages of the reader would end up between the rows of the output
+  with contextlib.redirect_stdout(sys.stderr):
+    return batch_scorer.score(sys_file)
+
+
+def get_profiled_batch_scores(sys_file):
+  profiling.enable()
+  return get_batch_scores(sys_file), profiling.get_state()
+
+
+def merge_batch_profile(profiled_scores):
+  scores, profile = profiled_scores
+  profiling.merge_state(profile)
+  return scores
+
+
+def print_scores(scores):
+  print_metric_scores(scores['metrics'], scores['conll'])
+
+  if scores['bootstrap'] is not None:
+    print('============================================')
+    print('Bootstrap 95% confidence intervals of the F1 scores:')
+    for name, (lower, upper) in scores['bootstrap']:
+      print('%s: [%.2f, %.2f]' % (name if name != 'conll' else 'CoNLL score',
+          lower * 100, upper * 100))
+
+  if scores['non_referring'] is not None:
+    recall, precision, f1 = scores['non_referring']
     print('============================================')
     print('Non-referring markable identification scores:')
     print('Recall: %.2f' % (recall * 100),
         ' Precision: %.2f' % (precision * 100),
         ' F1: %.2f' % (f1 * 100))
-  if keep_bridging:
-    score_ar, score_fbm, score_fbe = evaluator.evaluate_bridgings(doc_bridging_infos)
+  if scores['bridging'] is not None:
+    score_ar, score_fbm, score_fbe = scores['bridging']
     recall_ar, precision_ar, f1_ar = score_ar
     recall_fbm, precision_fbm, f1_fbm = score_fbm
     recall_fbe, precision_fbe, f1_fbe = score_fbe
@@ -148,5 +371,21 @@ def evaluate(key_file, sys_file, metrics, keep_singletons, keep_split_antecedent
     print('Recall: %.2f' % (recall_fbe * 100),
           ' Precision: %.2f' % (precision_fbe * 100),
           ' F1: %.2f' % (f1_fbe * 100))
+  if scores['discourse_deixis'] is not None:
+    print('============================================')
+    print('Discourse deixis scores:')
+    print_metric_scores(scores['discourse_deixis']['metrics'], scores['discourse_deixis']['conll'])
+
+
+def print_metric_scores(metric_scores, conll):
+  for name, (recall, precision, f1) in metric_scores:
+    print(name)
+    print('Recall: %.2f' % (recall * 100),
+        ' Precision: %.2f' % (precision * 100),
+        ' F1: %.2f' % (f1 * 100))
+
+  if conll is not None:
+    print('CoNLL score: %.2f' % conll)
 
-main()
+if __name__ == '__main__':
+  main()
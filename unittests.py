@@ -2,6 +2,8 @@ from pytest import approx
 from coval.conll.reader import get_coref_infos
 from coval.eval.evaluator import evaluate_documents as evaluate
 from coval.eval.evaluator import muc, b_cubed, ceafe, lea, ceafm,blancc,blancn
+import gzip
+import lzma
 
 TOL = 1e-4
 
@@ -337,4 +339,15 @@ def test_N6():
   assert evaluate(doc, lea) == approx([0, 0, 0])
   # the original is wrong as the |C_r| != 0
   # assert evaluate(doc, [blancc, blancn]) == approx([0.13333, 0.18182, 0.15385], abs=TOL)
-  assert evaluate(doc, [blancc, blancn]) == approx([0.13333/2, 0.18182/2, 0.15385/2], abs=TOL)
\ No newline at end of file
+  assert evaluate(doc, [blancc, blancn]) == approx([0.13333/2, 0.18182/2, 0.15385/2], abs=TOL)
+
+
+def test_compressed_files(tmp_path):
+  for name, open_compressed in [('TC-A.key.gz', gzip.open), ('TC-A-4.response.xz', lzma.open)]:
+    with open('tests/' + name[:name.rindex('.')], 'rb') as f, open_compressed(str(tmp_path / name), 'wb') as out:
+      out.write(f.read())
+  doc = get_coref_infos(str(tmp_path / 'TC-A.key.gz'), str(tmp_path / 'TC-A-4.response.xz'),
+      False, False, True)
+  expected = read('TC-A.key', 'TC-A-4.response')
+  for metric in [muc, b_cubed, ceafe, ceafm, lea]:
+    assert evaluate(doc, metric) == evaluate(expected, metric)